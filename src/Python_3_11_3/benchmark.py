@@ -0,0 +1,421 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from typing import Callable
+import numpy as np
+
+import parse
+import process
+import periods
+from parse import _read_sonic, parse_data, get_var
+from process import detrend_signal, taper_signal, calc_spectrum, roll_mean, \
+    turbulente_intensitaet_bins
+from setup import CACHE_DIR, KERNEL_SIZE, TAPERING_SIZE, TI_INTERVAL_MIN, BENCHMARK_DIR
+
+
+# modules which must not be loaded when importing a module (they are
+# imported on first use), checked by bench_imports
+LAZY_IMPORTS = {
+    "cli": ["scipy", "pandas", "matplotlib", "seaborn"],
+    "main_calculation": ["scipy", "pandas", "matplotlib", "seaborn"],
+    "main_plotting": ["scipy", "pandas", "matplotlib", "seaborn"],
+    }
+
+# longest logger outage (gaps) and sensor dropout (NaN) of the synthetic files in s
+MAX_GAP_S = 30*60
+MAX_NAN_S = 10
+
+# -----------------------------------------------------------------------------
+# synthetic raw files
+# -----------------------------------------------------------------------------
+
+def _random_blocks(n: int, count: int, max_len: int, rng: np.random.Generator) -> np.ndarray:
+    """Return a mask of n samples with count blocks of 1 to max_len samples
+    at random positions."""
+    mask = np.zeros(n, dtype=bool)
+    for start, length in zip(rng.integers(0, n, count), rng.integers(1, max_len+1, count)):
+        mask[start:start+length] = True
+    return mask
+
+def _dropouts(n: int, rate: int, gaps: int, nan_fraction: float, rng: np.random.Generator
+              ) -> tuple[np.ndarray, np.ndarray]:
+    """Return the masks of the samples written (without the gaps) and of the
+    samples written as NaN (about nan_fraction of all samples)."""
+    keep = ~_random_blocks(n, gaps, MAX_GAP_S*rate, rng)
+    n_nan = round(nan_fraction * n / ((1 + MAX_NAN_S*rate) / 2))
+    nan = _random_blocks(n, n_nan, MAX_NAN_S*rate, rng)
+    return keep, nan
+
+def _temperature(ns: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Return a temperature with a daily cycle and noise at the times ns (UTC
+    in ns since the start of the day)."""
+    hour_of_day = (ns / 3.6e12) % 24
+    return 20 - 6*np.cos(2*np.pi*(hour_of_day - 3)/24) + rng.normal(0, 0.2, len(ns))
+
+def write_toa5(
+        fn: str,
+        start_datetime: str,
+        hours: float,
+        rate: int = 20,
+        seed: int = 0,
+        gaps: int = 0,
+        nan_fraction: float = 0.0
+        ) -> int:
+    """Write a synthetic SONIC file in TOA5 format (logger time UTC+1) and
+    return the number of data rows. The logger stops gaps times for up to
+    MAX_GAP_S and about nan_fraction of the rows are "NAN" (runs of up to
+    MAX_NAN_S), as in the raw files."""
+
+    rng = np.random.default_rng(seed)
+    n = int(hours * 3600 * rate)
+
+    # timestamps as written by the logger: fraction of seconds without trailing zeros
+    ns = np.arange(n, dtype=np.int64) * (10**9 // rate)
+    dt = np.datetime64(start_datetime, "ns") + ns.astype("timedelta64[ns]")
+    seconds = np.datetime_as_string(dt, unit="s").astype("S19")
+    seconds.view(np.uint8).reshape(-1, 19)[:, 10] = ord(" ")
+    fractions = np.array([f"{i/rate:.3f}"[1:].rstrip("0").rstrip(".") for i in range(rate)], dtype="S4")
+    timestamps = np.char.add(seconds, fractions[np.arange(n) % rate]).astype(str)
+
+    # wind components as random walks plus noise, temperature with a daily cycle
+    wind_x = np.cumsum(rng.normal(0, 0.01, n)) + rng.normal(0, 0.3, n)
+    wind_y = np.cumsum(rng.normal(0, 0.01, n)) + rng.normal(0, 0.3, n)
+    wind_z = rng.normal(0, 0.2, n)
+    t = _temperature(ns, rng)
+    keep, nan = _dropouts(n, rate, gaps, nan_fraction, rng)
+
+    with open(fn, "w", newline="") as f:
+        f.write('"TOA5","7134","CR1000X","7134","CR1000X.Std.05.01","CPU:cr1000_1_MH.CR1x","41629","Raw"\n'
+                '"TIMESTAMP","RECORD","wind1(1)","wind1(2)","wind1(3)","wind1(4)","wind1(5)"\n'
+                '"TS","RN","","","","",""\n'
+                '"","","Smp","Smp","Smp","Smp","Smp"\n')
+        rows = zip(timestamps.tolist(), range(n), wind_x.tolist(), wind_y.tolist(),
+                   wind_z.tolist(), t.tolist(), nan.tolist(), keep.tolist())
+        f.writelines(('"%s",%d,"NAN","NAN","NAN","NAN","NAN"\n' % row[:2]) if row[6]
+                     else ('"%s",%d,%.2f,%.2f,%.2f,%.2f,0\n' % row[:6])
+                     for row in rows if row[7])
+    return int(np.count_nonzero(keep))
+
+def write_expe_log(
+        fn: str,
+        start_datetime: str,
+        hours: float,
+        seed: int = 0,
+        gaps: int = 0,
+        nan_fraction: float = 0.0
+        ) -> int:
+    """Write a synthetic EXPE log (UTC, one sample of each sensor per second)
+    and return the number of seconds written. Gaps and NaN (empty values of
+    the temperature sensor 0) as in write_toa5."""
+
+    rng = np.random.default_rng(seed)
+    n = int(hours * 3600)
+
+    ns = np.arange(n, dtype=np.int64) * 10**9
+    dt = np.datetime64(start_datetime, "ns") + ns.astype("timedelta64[ns]")
+    dates = np.datetime_as_string(dt, unit="D").tolist()
+    times = [s[11:] for s in np.datetime_as_string(dt, unit="s").tolist()]
+
+    # sensor 0: temperature in 1/100 °C, humidity and pressure; sensor 2 and
+    # 1 (GPS) are not used by the parser
+    t = np.round(_temperature(ns, rng) * 100).astype(np.int64)
+    humidity = np.round(6000 + 2000*np.sin(2*np.pi*ns/8.64e13) + rng.normal(0, 50, n)).astype(np.int64)
+    pressure = np.round(1005000 + np.cumsum(rng.normal(0, 2, n))).astype(np.int64)
+    keep, nan = _dropouts(n, 1, gaps, nan_fraction, rng)
+    t_str = np.where(nan, "", t.astype(str)).tolist()
+
+    with open(fn, "w", newline="") as f:
+        f.write("Date;Time;Module Address;Module Command;Value1;Value2;Value3;Value4\n")
+        f.write(f"{dates[0]};{times[0]};1;101;2018-01-01;00:01:59\n")
+        rows = zip(dates, times, t_str, humidity.tolist(), pressure.tolist(), keep.tolist())
+        f.writelines(f"{d};{tm};1;0;48;{v};{h};{p}\n"
+                     f"{d};{tm};1;2;34;3918;29552;98\n"
+                     f"{d};{tm};1;1;49;1346;510307402;134354223\n"
+                     for d, tm, v, h, p, k in rows if k)
+    return int(np.count_nonzero(keep))
+
+def write_campaign(
+        data_dir: str,
+        start_datetime: str,
+        hours: float,
+        rate: int = 20,
+        seed: int = 0,
+        gaps: int = 0,
+        nan_fraction: float = 0.0
+        ) -> dict[str, int]:
+    """
+    Write a synthetic measurement in data_dir (raw files named like the
+    loggers do in raw_data/YYYY_MM_DD/ and periods.csv with the period
+    "BENCH" covering it) and return the number of rows by device. The raw
+    files grow for the whole duration like a logger which is not restarted.
+    """
+    start = np.datetime64(start_datetime, "s")
+    end = start + np.timedelta64(int(hours*3600) - 1, "s")
+    sonic_start = start + np.timedelta64(1, "h")    # logger time UTC+1
+    day_dir = os.path.join(data_dir, "raw_data", str(start.astype("datetime64[D]")).replace("-", "_"))
+    os.makedirs(day_dir, exist_ok=True)
+
+    expe_fn = os.path.join(day_dir, start.astype(datetime).strftime("%Y%m%d-%H%M-Log.txt"))
+    sonic_fn = os.path.join(day_dir, sonic_start.astype(datetime).strftime("TOA5_7134.Raw_%Y_%m_%d_%H%M.dat"))
+    rows = {
+        "EXPE": write_expe_log(expe_fn, str(start), hours, seed, gaps, nan_fraction),
+        "SONIC": write_toa5(sonic_fn, str(sonic_start), hours, rate, seed, gaps, nan_fraction)
+        }
+
+    with open(os.path.join(data_dir, "periods.csv"), "w") as f:
+        f.write("name,start,end,expe_fn,sonic_fn,note\n")
+        f.write(f"BENCH,{str(start).replace('T', ' ')},{str(end).replace('T', ' ')},"
+                f"{expe_fn},{sonic_fn},synthetic\n")
+    return rows
+
+# -----------------------------------------------------------------------------
+# benchmarks
+# -----------------------------------------------------------------------------
+
+def _timeit(func: Callable, repeat: int, prepare: Callable | None = None) -> list[float]:
+    """Return the run times of func in s, prepare is called before each run
+    (not timed)."""
+    times = []
+    for _ in range(repeat):
+        if prepare is not None:
+            prepare()
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return times
+
+def _clear_parse_caches(disk: bool) -> None:
+    """Forget the parsed raw files kept in memory (and on disk if disk)."""
+    parse._load_raw_in_memory.cache_clear()
+    if disk:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+def _commit() -> str | None:
+    """Return the current git commit of the code or None."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_suite(
+        days: float = 1,
+        rate: int = 20,
+        gaps: int = 0,
+        nan_fraction: float = 0.0,
+        repeat: int = 3,
+        plots: bool = True,
+        seed: int = 0
+        ) -> dict:
+    """
+    Benchmark the pipeline on a synthetic measurement of days at rate Hz
+    (SONIC) and return the results: run times of parse_data (from the raw
+    files and from the parse cache), of the processing steps and of
+    representative plots for the SONIC temperature, with items per second.
+    The data and the plots are written to a temporary directory.
+    """
+    from plot import plot_ts, plot_spectrum, plot_avg
+
+    results = {}
+
+    def bench(name: str, func: Callable, items: int, prepare: Callable | None = None) -> None:
+        times = _timeit(func, repeat, prepare)
+        best = min(times)
+        results[name] = {"best_s": best, "median_s": float(np.median(times)),
+                         "times_s": times, "items": items, "items_per_s": items / best}
+        print(f"\t{name}: best of {repeat}: {best:.3f} s ({items/best:,.0f} items/s)")
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            # the paths in setup.py are relative to the working directory
+            os.chdir(tmp_dir)
+            for plot_dir in ["preprocessing", "spectra", "averaging"]:
+                os.makedirs(os.path.join("plots", plot_dir))
+            rows = write_campaign("data", "2023-08-11 00:00:00", days*24, rate, seed,
+                                  gaps, nan_fraction)
+            periods.periods.cache_clear()
+            print(f"Synthetic data: {days} d, EXPE 1 Hz ({rows['EXPE']} rows), "
+                  f"SONIC {rate} Hz ({rows['SONIC']} rows), {gaps} gaps, "
+                  f"{nan_fraction:.1%} NaN")
+
+            for device in ["EXPE", "SONIC"]:
+                bench(f"parse_data[{device}] raw", lambda: parse_data(device, "BENCH"),
+                      rows[device], prepare=lambda: _clear_parse_caches(disk=True))
+                bench(f"parse_data[{device}] cache", lambda: parse_data(device, "BENCH"),
+                      rows[device], prepare=lambda: _clear_parse_caches(disk=False))
+
+            x = np.array(get_var("SONIC", "BENCH", "Datetime"))
+            y = np.array(get_var("SONIC", "BENCH", "t"))
+            y_det = detrend_signal(y)
+            y_tap = taper_signal(y_det, TAPERING_SIZE)
+            _, spec = calc_spectrum(x, y_tap)
+            n = len(y)
+
+            bench("detrend_signal", lambda: detrend_signal(y), n)
+            bench("taper_signal", lambda: taper_signal(y_det, TAPERING_SIZE), n,
+                  prepare=process._taper_scaling.cache_clear)
+            bench("calc_spectrum", lambda: calc_spectrum(x, y_tap), n)
+            bench("roll_mean", lambda: roll_mean(spec, win_len=KERNEL_SIZE), len(spec))
+            bench("turbulente_intensitaet_bins",
+                  lambda: turbulente_intensitaet_bins(x, y, TI_INTERVAL_MIN), n)
+
+            if plots:
+                bench("plot_ts", lambda: plot_ts(x, y, fn="BENCH", title="BENCH"), n)
+                bench("plot_spectrum", lambda: plot_spectrum(x, y, fn="BENCH", ylabel="t",
+                                                             title="BENCH"), n)
+                bench("plot_avg", lambda: plot_avg(x, y, device="SONIC", title="BENCH",
+                                                   fn="BENCH"), n)
+        finally:
+            os.chdir(cwd)
+            periods.periods.cache_clear()
+            parse._load_raw_in_memory.cache_clear()
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "parameters": {"days": days, "rate": rate, "gaps": gaps, "nan_fraction": nan_fraction,
+                       "repeat": repeat, "seed": seed},
+        "rows": rows,
+        "results": results
+        }
+
+def save_suite(suite: dict, fn: str | None = None) -> str:
+    """Save the results of bench_suite as JSON (default: in BENCHMARK_DIR,
+    named by date and commit) and return the file name."""
+    if fn is None:
+        created = suite["created"].replace(":", "").replace("-", "")
+        fn = os.path.join(BENCHMARK_DIR, f"benchmark_{created}_{suite['commit'] or 'nocommit'}.json")
+    os.makedirs(os.path.dirname(fn) or ".", exist_ok=True)
+    with open(fn, "w") as f:
+        json.dump(suite, f, indent=2)
+    return fn
+
+def compare_suites(old_fn: str, new_fn: str) -> None:
+    """Print the best run times of two saved benchmark results and the
+    speedup of the new one."""
+    with open(old_fn) as f:
+        old = json.load(f)
+    with open(new_fn) as f:
+        new = json.load(f)
+    if old["parameters"] != new["parameters"]:
+        print("Warning: different parameters", old["parameters"], new["parameters"])
+
+    print(f"{'':30s} {old['commit'] or old_fn:>12s} {new['commit'] or new_fn:>12s}")
+    for name, result in new["results"].items():
+        if name in old["results"]:
+            old_s, new_s = old["results"][name]["best_s"], result["best_s"]
+            print(f"{name:30s} {old_s:10.3f} s {new_s:10.3f} s {old_s/new_s:6.2f}x")
+
+def bench_parse_sonic(days: float, rate: int, repeat: int) -> None:
+    """Print the throughput of the SONIC parser on a synthetic file."""
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fn = os.path.join(tmp_dir, "TOA5_0000.Raw_2023_08_11_0000.dat")
+        n = write_toa5(fn, "2023-08-11 00:00:00", hours=days*24, rate=rate)
+        size = os.path.getsize(fn)
+
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            _read_sonic(fn)
+            times.append(time.perf_counter() - t0)
+
+    best = min(times)
+    print(f"SONIC parser: {n} rows ({size/1024**2:.0f} MB, {days} d at {rate} Hz)")
+    print(f"\tbest of {repeat}: {best:.2f} s = {n/best:,.0f} rows/s")
+
+def import_times(module: str) -> list[tuple[int, str, float]]:
+    """Return (depth, name, cumulative time in s) of all modules loaded by
+    importing module in a new interpreter (python -X importtime)."""
+
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [src_dir] + ([os.environ["PYTHONPATH"]] if "PYTHONPATH" in os.environ else [])))
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            env=env, capture_output=True, text=True, check=True).stderr
+
+    times = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():    # skip the header
+            depth = (len(name) - len(name.lstrip())) // 2
+            times.append((depth, name.strip(), int(cumulative) / 1e6))
+    return times
+
+def bench_imports(repeat: int, lazy_imports: dict[str, list[str]] = LAZY_IMPORTS) -> list[str]:
+    """Print the import time of the modules in lazy_imports and return the
+    modules which load one of their lazy imports."""
+
+    failed = []
+    for module, lazy in lazy_imports.items():
+        runs = [import_times(module) for _ in range(repeat)]
+        times = min(runs, key=lambda times: times[-1][2])
+        print(f"import {module}: best of {repeat}: {times[-1][2]*1000:.0f} ms")
+
+        # modules imported by module itself: listed before it, after the
+        # previous top-level import
+        first = max([i for i, t in enumerate(times[:-1]) if t[0] == 0], default=-1) + 1
+        direct = sorted([t for t in times[first:-1] if t[0] == 1],
+                        key=lambda t: t[2], reverse=True)
+        for _, name, seconds in direct[:5]:
+            print(f"\t{name}: {seconds*1000:.0f} ms")
+
+        loaded = sorted({name.split(".")[0] for _, name, _ in times} & set(lazy))
+        if loaded:
+            print(f"\t{module} loads {', '.join(loaded)} at import")
+            failed.append(module)
+    return failed
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options of the benchmarks to parser (see run)."""
+    parser.add_argument("--days", type=float, default=1,
+                        help="duration of the synthetic measurement (e.g. 0.25 or 14)")
+    parser.add_argument("--rate", type=int, default=20, help="SONIC sample rate in Hz (1-20)")
+    parser.add_argument("--gaps", type=int, default=0, help="number of logger outages")
+    parser.add_argument("--nan", type=float, default=0.0, help="fraction of NaN rows")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs")
+    parser.add_argument("--no-plots", action="store_true", help="skip the plot benchmarks")
+    parser.add_argument("--out", default=None,
+                        help=f"JSON file of the results (default: in {BENCHMARK_DIR}/)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two JSON files of results instead")
+    parser.add_argument("--parser", action="store_true",
+                        help="only measure the throughput of the SONIC parser")
+    parser.add_argument("--imports", action="store_true",
+                        help="measure the import time of the scripts instead")
+
+def run(args: argparse.Namespace) -> list[str]:
+    """Run the benchmarks selected by the options of add_arguments, return
+    the failed checks."""
+    if args.compare:
+        compare_suites(*args.compare)
+    elif args.imports:
+        return bench_imports(args.repeat)
+    elif args.parser:
+        bench_parse_sonic(args.days, args.rate, args.repeat)
+    else:
+        suite = bench_suite(args.days, args.rate, args.gaps, args.nan, args.repeat,
+                            plots=not args.no_plots)
+        print("Results saved in", save_suite(suite, args.out))
+    return []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic data.")
+    add_arguments(parser)
+    sys.exit(1 if run(parser.parse_args()) else 0)
@@ -0,0 +1,119 @@
+import sys
+import argparse
+
+from setup import all_puos, variables, PLOT_TYPES, RENDER_PROFILE, RENDER_PROFILES
+from jobs import run_jobs, up_to_date
+
+
+DEVICES = ["EXPE", "SONIC"]
+
+
+def _select(tasks: list, changed_only: bool) -> list:
+    """Return the jobs of (job, inputs, outputs) tasks, without the jobs whose
+    outputs are up to date if changed_only."""
+    jobs = [job for job, inputs, outputs in tasks
+            if not (changed_only and up_to_date(inputs, outputs))]
+    if len(jobs) < len(tasks):
+        print(f"\t {len(tasks) - len(jobs)} of {len(tasks)} jobs up to date")
+    return jobs
+
+def run_calculate(args: argparse.Namespace) -> list[str]:
+    """Run the analysis and save the data, return the failed jobs."""
+    from main_calculation import calculate, compare, calculate_files, compare_files
+
+    print("Process EXPE and SONIC data...")
+    tasks = [((f"{period} & {device}", calculate, (device, period)), *calculate_files(device, period))
+             for device in args.device for period in args.period]
+    _, failed = run_jobs(_select(tasks, args.changed_only), n_jobs=args.jobs)
+
+    print("Compare EXPE and SONIC data...")
+    tasks = [((period, compare, (period,)), *compare_files(period)) for period in args.period]
+    _, failed_comp = run_jobs(_select(tasks, args.changed_only), n_jobs=args.jobs)
+    return failed + failed_comp
+
+def run_plot(args: argparse.Namespace) -> list[str]:
+    """Plot the data, return the failed jobs."""
+    from main_plotting import plot_tasks, save_error_metrics, error_metrics_task
+    from plot import set_render_profile
+
+    set_render_profile(args.profile)
+    failed = []
+    for plot_type in [plot_type for plot_type in PLOT_TYPES if plot_type in args.plot]:
+        print(f"Plot {plot_type}...")
+        tasks = plot_tasks(plot_type, args.period, args.device, args.variable)
+        results, failed_plot = run_jobs(_select(tasks, args.changed_only), n_jobs=args.jobs)
+        failed += failed_plot
+
+        if plot_type == "averaging":
+            save_error_metrics([row for rows in results if rows for row in rows])
+            _, failed_plot = run_jobs(_select([error_metrics_task()], args.changed_only))
+            failed += failed_plot
+    return failed
+
+def run_benchmark(args: argparse.Namespace) -> list[str]:
+    """Run the benchmarks, return the failed checks (see benchmark.py)."""
+    from benchmark import run
+    return run(args)
+
+def parser() -> argparse.ArgumentParser:
+    from periods import periods
+
+    parser = argparse.ArgumentParser(description="Analysis of the EXPE and SONIC measurements.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    # options of calculate and plot
+    selection = argparse.ArgumentParser(add_help=False)
+    selection.add_argument("-p", "--period", nargs="+", default=all_puos, metavar="PERIOD",
+                           choices=[p.name for p in periods()],
+                           help="periods (default: all PUOs in setup.py)")
+    selection.add_argument("-d", "--device", nargs="+", default=DEVICES, choices=DEVICES,
+                           help="measuring devices (default: both)")
+    selection.add_argument("-j", "--jobs", type=int, default=1,
+                           help="number of parallel processes")
+    selection.add_argument("--changed-only", action="store_true",
+                           help="skip jobs whose outputs are newer than their inputs "
+                                "(raw files, periods.csv, code)")
+    selection.add_argument("--instrument", action="store_true",
+                           help="record time and memory of the stages, parser, processing "
+                                "and plots (report in data/instrument/)")
+    selection.add_argument("--trace-memory", action="store_true",
+                           help="with --instrument, also record the peak of the memory "
+                                "allocated by Python (slower)")
+
+    calc = commands.add_parser("calculate", parents=[selection],
+                               help="run the analysis and save the data")
+    calc.set_defaults(func=run_calculate)
+
+    plots = commands.add_parser("plot", parents=[selection], help="plot the data")
+    plots.add_argument("--plot", nargs="+", default=["spectra"], choices=PLOT_TYPES,
+                     help="plot types (default: spectra)")
+    plots.add_argument("-v", "--variable", nargs="+", default=None,
+                     choices=sorted({var for device in DEVICES for var in variables[device]}),
+                     help="variables of the plots per variable (default: all)")
+    plots.add_argument("--profile", default=RENDER_PROFILE, choices=list(RENDER_PROFILES),
+                     help=f"render profile, see RENDER_PROFILES in setup.py (default: {RENDER_PROFILE})")
+    plots.set_defaults(func=run_plot)
+
+    bench = commands.add_parser("benchmark", help="benchmark the pipeline on synthetic data")
+    from benchmark import add_arguments
+    add_arguments(bench)
+    bench.set_defaults(func=run_benchmark)
+    return parser
+
+def main(argv: list[str] | None = None) -> int:
+    args = parser().parse_args(argv)
+    if getattr(args, "instrument", False):
+        import instrument
+        instrument.enable(args.trace_memory)
+    failed = args.func(args)
+    if getattr(args, "instrument", False):
+        print("Report saved in", instrument.write_report())
+    if failed:
+        print("Failed:", ", ".join(failed))
+        return 1
+    print("Done!")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
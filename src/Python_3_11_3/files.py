@@ -0,0 +1,20 @@
+import os
+from typing import BinaryIO, Callable
+
+
+def atomic_write(fn: str, writer: Callable[[BinaryIO], None]) -> None:
+    """
+    Write a file with writer(f) into a temporary file and replace fn with it,
+    so an interrupted run leaves no corrupt file. The temporary file is named
+    per process, so processes writing the same file do not interfere, and
+    removed if writer fails.
+    """
+    tmp_fn = f"{fn}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_fn, "wb") as f:
+            writer(f)
+        os.replace(tmp_fn, fn)
+    except BaseException:
+        if os.path.exists(tmp_fn):
+            os.remove(tmp_fn)
+        raise
@@ -0,0 +1,252 @@
+import os
+import sys
+import csv
+import json
+import time
+import inspect
+import importlib
+import functools
+from datetime import datetime
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from setup import INSTRUMENT_DIR
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+
+# Instrumentation is switched on with enable() (cli.py --instrument). The
+# setting is passed to the worker processes of jobs.py by the environment,
+# each process appends its records to its own file, and write_report merges
+# them. When disabled, an instrumented function only costs one check.
+_ENV = "INSTRUMENT_RUN"             # "<run id>" or "<run id>:tracemalloc"
+_LABELS = {"period": "period", "device": "device", "var": "variable"}
+_FIELDS = ["name", "period", "device", "variable", "depth", "pid", "wall_s", "cpu_s",
+           "peak_rss_mb", "alloc_peak_mb", "input_bytes", "input_len"]
+
+# libraries the pipeline imports on first use; when instrumented, they are
+# imported before the measurements (recorded as "import"), so the import time
+# is not charged to the first measured call of each process
+_PRELOAD = ["pandas", "scipy.fft", "scipy.signal", "scipy.ndimage"]
+
+_run_id = None
+_tracemalloc = False
+_stack = []                         # labels and allocation peak of the open measurements
+
+
+def _configure() -> None:
+    global _run_id, _tracemalloc
+    run = os.environ.get(_ENV)
+    _run_id, _, option = run.partition(":") if run else (None, "", "")
+    _tracemalloc = option == "tracemalloc"
+    if _tracemalloc:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+def enabled() -> bool:
+    return _run_id is not None
+
+def enable(trace_memory: bool = False) -> str:
+    """Switch on the instrumentation of this process and of the processes
+    started by it and return the id of the run. With trace_memory the peak
+    of the memory allocated by Python (tracemalloc) is recorded, which slows
+    down the run."""
+    run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    os.environ[_ENV] = run_id + (":tracemalloc" if trace_memory else "")
+    _configure()
+    _preload()
+    return run_id
+
+def _records_fn(run_id: str, pid: int | str) -> str:
+    return os.path.join(INSTRUMENT_DIR, f"records_{run_id}_{pid}.jsonl")
+
+# -----------------------------------------------------------------------------
+# measuring
+# -----------------------------------------------------------------------------
+
+def _size(value: Any, nested: bool = True) -> tuple[int, int]:
+    """Return bytes and length (last axis) of an array, of the arrays in a
+    dict, list or tuple (one level), or the size of an existing file."""
+    if hasattr(value, "nbytes") and hasattr(value, "shape"):
+        return int(value.nbytes), int(value.shape[-1]) if value.shape else 1
+    if isinstance(value, str) and os.path.isfile(value):
+        return os.path.getsize(value), 0
+    if nested and isinstance(value, (dict, list, tuple)):
+        sizes = [_size(v, nested=False)
+                 for v in (value.values() if isinstance(value, dict) else value)]
+        return sum(s[0] for s in sizes), max((s[1] for s in sizes), default=0)
+    return 0, 0
+
+@contextmanager
+def measure(name: str, inputs: tuple = (), **labels: str) -> Iterator[None]:
+    """Record wall time, CPU time, peak memory and the size of the inputs of
+    the enclosed code. Labels (period, device, variable) not given are taken
+    from the enclosing measurement."""
+    if not enabled():
+        yield
+        return
+
+    parent = _stack[-1]["labels"] if _stack else {}
+    frame = {"labels": {**parent, **{k: v for k, v in labels.items() if v is not None}},
+             "alloc_peak": 0}
+    if _tracemalloc:
+        import tracemalloc
+        current, peak = tracemalloc.get_traced_memory()
+        if _stack:
+            _stack[-1]["alloc_peak"] = max(_stack[-1]["alloc_peak"], peak)
+        tracemalloc.reset_peak()
+        frame["alloc_start"] = current
+    _stack.append(frame)
+    sizes = [_size(value) for value in inputs]
+    input_bytes, input_len = sum(s[0] for s in sizes), max((s[1] for s in sizes), default=0)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        _stack.pop()
+        record = {"name": name, "period": None, "device": None, "variable": None,
+                  **frame["labels"], "depth": len(_stack), "pid": os.getpid(),
+                  "wall_s": wall, "cpu_s": cpu,
+                  "peak_rss_mb": _peak_rss_mb(),
+                  "alloc_peak_mb": None, "input_bytes": input_bytes, "input_len": input_len}
+        if _tracemalloc:
+            import tracemalloc
+            peak = max(frame["alloc_peak"], tracemalloc.get_traced_memory()[1])
+            record["alloc_peak_mb"] = (peak - frame["alloc_start"]) / 1024**2
+            if _stack:
+                _stack[-1]["alloc_peak"] = max(_stack[-1]["alloc_peak"], peak)
+        _write_record(record)
+
+def _peak_rss_mb() -> float | None:
+    """Return the peak resident memory of the process so far."""
+    if resource is None:
+        return None
+    # bytes on macOS, kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024**2 if sys.platform == "darwin" else 1024)
+
+def _write_record(record: dict) -> None:
+    os.makedirs(INSTRUMENT_DIR, exist_ok=True)
+    with open(_records_fn(_run_id, os.getpid()), "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+def _call(func: Callable, name: str, args: tuple, kwargs: dict, sizes: bool = True) -> Any:
+    try:
+        bound = inspect.signature(func).bind_partial(*args, **kwargs).arguments
+    except (TypeError, ValueError):
+        bound = {}
+    labels = {label: bound[param] for param, label in _LABELS.items()
+              if isinstance(bound.get(param), str)}
+    inputs = tuple(v for k, v in bound.items() if k not in _LABELS) if sizes else ()
+    with measure(name, inputs, **labels):
+        return func(*args, **kwargs)
+
+def instrumented(name: str | None = None, sizes: bool = True) -> Callable:
+    """Decorator recording each call of a function (see measure) under name
+    (default: the name of the function). The arguments period, device and
+    var are used as labels, the others as inputs (if sizes)."""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _run_id is None:
+                return func(*args, **kwargs)
+            return _call(func, name or func.__name__, args, kwargs, sizes)
+        return wrapper
+    return decorator
+
+def call(func: Callable, *args) -> Any:
+    """Call func and record it like an instrumented function."""
+    if _run_id is None:
+        return func(*args)
+    return _call(func, func.__name__, args, {})
+
+def _preload() -> None:
+    with measure("import"):
+        for module in _PRELOAD:
+            importlib.import_module(module)
+
+# worker processes of jobs.py
+_configure()
+if enabled():
+    _preload()
+
+# -----------------------------------------------------------------------------
+# report
+# -----------------------------------------------------------------------------
+
+def read_records(run_id: str | None = None) -> list[dict]:
+    """Return the records of a run (default: the current one) of all processes."""
+    run_id = run_id or _run_id
+    prefix = f"records_{run_id}_"
+    records = []
+    if os.path.isdir(INSTRUMENT_DIR):
+        for fn in sorted(os.listdir(INSTRUMENT_DIR)):
+            if fn.startswith(prefix) and fn.endswith(".jsonl"):
+                with open(os.path.join(INSTRUMENT_DIR, fn)) as f:
+                    records += [json.loads(line) for line in f if line.strip()]
+    return records
+
+def self_times(records: list[dict]) -> list[float]:
+    """Return the wall time of each record without the wall time of the
+    measurements nested in it. The records of a process are in the order
+    the measurements ended, so the nested records precede their parent."""
+    times = []
+    nested = {}     # (pid, depth): wall time of the ended records not yet assigned to a parent
+    for r in records:
+        times.append(r["wall_s"] - nested.pop((r["pid"], r["depth"] + 1), 0.0))
+        key = (r["pid"], r["depth"])
+        nested[key] = nested.get(key, 0.0) + r["wall_s"]
+    return times
+
+def summary(records: list[dict]) -> list[dict]:
+    """Return the records summed by name, sorted by self time (wall time
+    without nested measurements). The wall time includes the nested
+    measurements, so it must not be summed over the names."""
+    rows = {}
+    for r, self_s in zip(records, self_times(records)):
+        row = rows.setdefault(r["name"], {"name": r["name"], "calls": 0, "self_s": 0.0,
+                                          "wall_s": 0.0, "cpu_s": 0.0, "peak_rss_mb": 0.0,
+                                          "alloc_peak_mb": None, "input_mb": 0.0})
+        row["calls"] += 1
+        row["self_s"] += self_s
+        row["wall_s"] += r["wall_s"]
+        row["cpu_s"] += r["cpu_s"]
+        row["peak_rss_mb"] = max(row["peak_rss_mb"], r["peak_rss_mb"] or 0)
+        if r["alloc_peak_mb"] is not None:
+            row["alloc_peak_mb"] = max(row["alloc_peak_mb"] or 0, r["alloc_peak_mb"])
+        row["input_mb"] += r["input_bytes"] / 1024**2
+    return sorted(rows.values(), key=lambda row: row["self_s"], reverse=True)
+
+def print_summary(rows: list[dict]) -> None:
+    print(f"{'':32s} {'calls':>6s} {'self [s]':>9s} {'wall [s]':>9s} {'cpu [s]':>9s} "
+          f"{'RSS [MB]':>9s} {'alloc [MB]':>10s} {'input [MB]':>10s}")
+    for row in rows:
+        alloc = "" if row["alloc_peak_mb"] is None else f"{row['alloc_peak_mb']:.1f}"
+        print(f"{row['name'][:32]:32s} {row['calls']:6d} {row['self_s']:9.3f} {row['wall_s']:9.3f} "
+              f"{row['cpu_s']:9.3f} {row['peak_rss_mb']:9.1f} {alloc:>10s} {row['input_mb']:10.1f}")
+
+def write_report(run_id: str | None = None) -> str:
+    """Merge the records of a run (default: the current one) into a JSON
+    report (records and summary) and a CSV file of the records in
+    INSTRUMENT_DIR, print the summary and return the name of the JSON file."""
+    run_id = run_id or _run_id
+    records = read_records(run_id)
+    rows = summary(records)
+
+    fn = os.path.join(INSTRUMENT_DIR, f"report_{run_id}")
+    os.makedirs(INSTRUMENT_DIR, exist_ok=True)
+    with open(fn + ".json", "w") as f:
+        json.dump({"run": run_id, "summary": rows, "records": records}, f, indent=1)
+    with open(fn + ".csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=_FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+    for pid in {r["pid"] for r in records}:
+        os.remove(_records_fn(run_id, pid))
+
+    print_summary(rows)
+    return fn + ".json"
@@ -0,0 +1,65 @@
+import os
+import traceback
+from typing import Any, Callable
+
+import instrument
+
+
+Job = tuple[str, Callable, tuple]   # label, function, arguments
+
+
+def _init_worker() -> None:
+    """Prepare a worker process (no warnings)."""
+    import warnings
+    warnings.filterwarnings("ignore")
+
+def _run(func: Callable, args: tuple) -> tuple[Any, str | None]:
+    """Run a job and return its result and the traceback of a failure."""
+    try:
+        return instrument.call(func, *args), None
+    except Exception:
+        return None, traceback.format_exc()
+
+def run_jobs(jobs: list[Job], n_jobs: int = 1) -> tuple[list, list[str]]:
+    """
+    Run independent jobs, in n_jobs processes if n_jobs > 1.
+
+    Progress and errors are printed in the order of the jobs, so the output
+    does not depend on the scheduling. A failing job does not stop the
+    others: its result is None and its label is returned in the list of
+    failed jobs.
+    """
+    if n_jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker) as pool:
+            futures = [pool.submit(_run, func, args) for _, func, args in jobs]
+            outcomes = []
+            for future in futures:
+                try:
+                    outcomes.append(future.result())
+                except Exception:
+                    # e.g. a worker process died
+                    outcomes.append((None, traceback.format_exc()))
+                _report(jobs[len(outcomes)-1][0], outcomes[-1][1])
+    else:
+        outcomes = []
+        for label, func, args in jobs:
+            outcomes.append(_run(func, args))
+            _report(label, outcomes[-1][1])
+
+    results = [result for result, _ in outcomes]
+    failed = [job[0] for job, (_, error) in zip(jobs, outcomes) if error is not None]
+    return results, failed
+
+def up_to_date(inputs: list[str], outputs: list[str]) -> bool:
+    """Return True if all outputs exist and are newer than all inputs."""
+    if not all(os.path.exists(fn) for fn in outputs):
+        return False
+    newest_input = max((os.path.getmtime(fn) for fn in inputs if os.path.exists(fn)), default=0)
+    return min(os.path.getmtime(fn) for fn in outputs) >= newest_input
+
+def _report(label: str, error: str | None) -> None:
+    if error is None:
+        print("\t", label)
+    else:
+        print("\t", label, "FAILED\n", error)
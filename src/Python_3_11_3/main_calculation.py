@@ -1,187 +1,250 @@
-import pandas as pd
+import numpy as np
 import warnings
 warnings.filterwarnings("ignore")
 
-from setup import KERNEL_SIZE, TAPERING_SIZE, all_puos, SAMPLE_RATE, variables
-from parse import parse_data
-from process import detrend_signal, taper_signal, sample_freq, calc_spectrum, roll_mean, \
-    turbulente_intensitaet
+from setup import KERNEL_SIZE, TAPERING_SIZE, SAMPLE_RATE, variables, \
+    TIMESERIES_STORE, FFT_WORKERS, SPECTRUM_METHOD, WELCH_SEGMENT_MIN, WELCH_OVERLAP, \
+    WELCH_WINDOW, TI_INTERVAL_MIN, SPECTRUM_BINS, SAVE_FULL_SPECTRA, PERIODS_FN
+import setup
+import parse
+import process
+import periods
+from parse import get_var, file_fingerprint
+from process import detrend_signal, taper_signal, calc_spectrum, roll_mean, \
+    turbulente_intensitaet_bins, sample_rate, iter_segments, welch_spectrum, \
+    resample_signal, align_spectrum, log_bin_spectrum
+from periods import get_period
+from stage_cache import Stage, code_fingerprint, settings_fingerprint
+from store import write_series
+from results import write_results, results_fn
+from instrument import instrumented
 
 
-# -----------------------------------------------------------------------------
-# process EXPE data
-# -----------------------------------------------------------------------------
+# results are recomputed when the code of the pipeline changes
+CODE = code_fingerprint(__file__, parse.__file__, process.__file__)
+
+# ... or a setting in setup.py; the parameters of single stages are in their
+# keys (only the stages downstream are recomputed), the other settings below
+# do not change the results
+SETTINGS = settings_fingerprint(setup, exclude={
+    "TAPERING_SIZE", "KERNEL_SIZE", "TI_INTERVAL_MIN", "SPECTRUM_BINS", "SPECTRUM_METHOD",
+    "WELCH_SEGMENT_MIN", "WELCH_OVERLAP", "WELCH_WINDOW", "FFT_WORKERS",
+    "labels", "WINDOWS_MIN", "MITTELUNGSINTERVALL", "all_puos", "PLOT_TYPES", "PLOT_DECIMATION",
+    "RENDER_PROFILE", "RENDER_PROFILES", "SAVE_FULL_SPECTRA", "RESULTS_DIR", "RESULTS_FORMAT",
+    "RESULTS_COMPRESS", "CACHE_DIR", "PARSE_CACHE", "RAW_FILES_IN_MEMORY", "STAGE_CACHE",
+    "STAGE_CACHE_DIR", "BENCHMARK_DIR", "INSTRUMENT_DIR", "TIMESERIES_STORE",
+    "TIMESERIES_STORE_DIR", "window_functions"})
+
+# files the results depend on besides the raw files (see calculate_files)
+DEPENDENCIES = [__file__, parse.__file__, process.__file__, setup.__file__, periods.__file__,
+                PERIODS_FN]
+
 
-print("Process EXPE data...")
-for period in all_puos:
-    # load data
-    data = parse_data("EXPE", period)
-    dt = data["Datetime"].to_numpy()
-    t = data["t"].to_numpy()
-    
-    # calculate detrended and tapered time series
-    timeseries_data = {}
-    timeseries_data["datetime"] = dt
-    timeseries_data["t"] = t
-    timeseries_data["t_det"] = detrend_signal(t)
-    timeseries_data["t_tap"] = taper_signal(timeseries_data["t_det"], TAPERING_SIZE)
-    
-    pd.DataFrame.from_dict(timeseries_data).to_csv(
-        f"data/timeseries_data/{period}_EXPE_preprocessed_data.csv", index=False)
-    
-    # calculate spectrum and smooth it with rolling mean
-    spectrum_data = {}
-    spectrum_data["frequencies"] = sample_freq(dt)
-    spectrum_data["t_spec"] = calc_spectrum(dt, timeseries_data["t_tap"])[1]
-    spectrum_data["t_spec_smooth"] = roll_mean(spectrum_data["t_spec"], win_len=KERNEL_SIZE)
-    
-    pd.DataFrame.from_dict(spectrum_data).to_csv(
-            f"data/spectra_data/{period}_EXPE_spectrum_data.csv", index=False)
-    
-    # calculate turbulence intensity
-    all_timesteps = [pd.Timestamp(dt[i]) for i in range(len(dt))]
-    timesteps = [i for i in all_timesteps if i.minute % 10 == 0 and i.second == 0]
-    
-    _df = pd.DataFrame.from_dict(timeseries_data)
-    ti_data = {}
-    for var in variables["EXPE"]:    
-        ti_abs = []
-        ti_rel = []
-        
-        for i in range(len(timesteps)-1):
-            left = timesteps[i]
-            right = timesteps[i+1]
-            _df_sel = _df[(_df["datetime"] >= left) & (_df["datetime"] < right)]
-
-            ti_abs.append(turbulente_intensitaet(
-                    y=_df_sel[var].to_numpy(), 
-                    rel=False
-                ))
-            ti_rel.append(turbulente_intensitaet(
-                    y=_df_sel[var].to_numpy(), 
-                    rel=True
-                ))
-            
-        ti_data["from"] = [timesteps[i] for i in range(len(timesteps)-1)]
-        ti_data["to"] = [timesteps[i+1] for i in range(len(timesteps)-1)]
-        ti_data[f"{var}_abs"] = ti_abs
-        ti_data[f"{var}_rel"] = ti_rel
-
-    pd.DataFrame.from_dict(ti_data).to_csv(
-        f"data/turbulence_intensity_data/{period}_EXPE_turbulence_intensity_data.csv", index=False)
-    
 # -----------------------------------------------------------------------------
-# process SONIC data
+# stages
 # -----------------------------------------------------------------------------
 
-print("Process SONIC data...")
-for period in all_puos:
-    
-    # load data
-    data = parse_data("SONIC", period)
-    dt = data["Datetime"].to_numpy()
-    t = data["t"].to_numpy()
-    wind_z = data["wind_z"].to_numpy()
-    wind_h = data["wind_h"].to_numpy()
-    
-    # calculate detrended and tapered time series
+@instrumented()
+def load_data(device: str, period: str) -> dict[str, np.ndarray]:
+    """Stage 1: datetime and variables of the raw data."""
+    data = {"datetime": get_var(device, period, "Datetime")}
+    for var in variables[device]:
+        data[var] = get_var(device, period, var)
+    return data
+
+@instrumented()
+def preprocess_data(device: str, data: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Stage 2: raw, detrended and tapered time series."""
     timeseries_data = {}
-    timeseries_data["datetime"] = dt
-    
-    timeseries_data["t"] = t
-    timeseries_data["t_det"] = detrend_signal(t)
-    timeseries_data["t_tap"] = taper_signal(timeseries_data["t_det"], TAPERING_SIZE)
-    
-    timeseries_data["wind_z"] = wind_z
-    timeseries_data["wind_z_det"] = detrend_signal(wind_z)
-    timeseries_data["wind_z_tap"] = taper_signal(timeseries_data["wind_z_det"], TAPERING_SIZE)
-    
-    timeseries_data["wind_h"] = wind_h
-    timeseries_data["wind_h_det"] = detrend_signal(wind_h)
-    timeseries_data["wind_h_tap"] = taper_signal(timeseries_data["wind_h_det"], TAPERING_SIZE)
-    
-    pd.DataFrame.from_dict(timeseries_data).to_csv(
-        f"data/timeseries_data/{period}_SONIC_preprocessed_data.csv", index=False)
-    
-    # calculate spectrum and smooth it with rolling mean
-    spectrum_data = {}
-    spectrum_data["frequencies"] = sample_freq(dt)
-    
-    spectrum_data["t_spec"] = calc_spectrum(dt, timeseries_data["t_tap"])[1]
-    spectrum_data["t_spec_smooth"] = roll_mean(spectrum_data["t_spec"], win_len=KERNEL_SIZE)
-    
-    spectrum_data["wind_z_spec"] = calc_spectrum(dt, timeseries_data["wind_z_tap"])[1]
-    spectrum_data["wind_z_spec_smooth"] = roll_mean(spectrum_data["wind_z_spec"], win_len=KERNEL_SIZE)
-    
-    spectrum_data["wind_h_spec"] = calc_spectrum(dt, timeseries_data["wind_h_tap"])[1]
-    spectrum_data["wind_h_spec_smooth"] = roll_mean(spectrum_data["wind_h_spec"], win_len=KERNEL_SIZE)
-    
-    pd.DataFrame.from_dict(spectrum_data).to_csv(
-            f"data/spectra_data/{period}_SONIC_spectrum_data.csv", index=False)
-
-    # calculate turbulence intensity
-    all_timesteps = [pd.Timestamp(dt[i]) for i in range(len(dt))]
-    timesteps = [i for i in all_timesteps if i.minute % 10 == 0 and i.second == 0 and i.microsecond == 0]
-    
-    _df = pd.DataFrame.from_dict(timeseries_data)
-    ti_data = {}
-    for var in variables["SONIC"]:    
-        ti_abs = []
-        ti_rel = []
-        
-        for i in range(len(timesteps)-1):
-            left = timesteps[i]
-            right = timesteps[i+1]
-            _df_sel = _df[(_df["datetime"] >= left) & (_df["datetime"] < right)]
-
-            ti_abs.append(turbulente_intensitaet(
-                    y=_df_sel[var].to_numpy(), 
-                    rel=False
-                ))
-            ti_rel.append(turbulente_intensitaet(
-                    y=_df_sel[var].to_numpy(), 
-                    rel=True
-                ))
-            
-        ti_data["from"] = [timesteps[i] for i in range(len(timesteps)-1)]
-        ti_data["to"] = [timesteps[i+1] for i in range(len(timesteps)-1)]
-        ti_data[f"{var}_abs"] = ti_abs
-        ti_data[f"{var}_rel"] = ti_rel
-
-    pd.DataFrame.from_dict(ti_data).to_csv(
-        f"data/turbulence_intensity_data/{period}_SONIC_turbulence_intensity_data.csv", index=False)
-    
-# -----------------------------------------------------------------------------
-# process EXPE and SONIC data and store them in one file
-# -----------------------------------------------------------------------------
+    timeseries_data["datetime"] = data["datetime"]
+
+    for var in variables[device]:
+        timeseries_data[var] = data[var]
+        timeseries_data[f"{var}_det"] = detrend_signal(data[var])
+        timeseries_data[f"{var}_tap"] = taper_signal(timeseries_data[f"{var}_det"], TAPERING_SIZE)
+    return timeseries_data
+
+@instrumented()
+def periodogram_data(device: str, timeseries_data: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Stage 3: spectra of the tapered time series of all variables (calculated at once)."""
+    freq, spectra = calc_spectrum(
+        timeseries_data["datetime"],
+        np.stack([timeseries_data[f"{var}_tap"] for var in variables[device]]),
+        workers=FFT_WORKERS)
+
+    spectra_data = {"frequencies": freq}
+    for var, spec in zip(variables[device], spectra):
+        spectra_data[f"{var}_spec"] = spec
+    return spectra_data
+
+@instrumented()
+def welch_data(device: str, timeseries_data: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Stage 3 (SPECTRUM_METHOD "welch"): mean spectra of the windowed segments
+    of the raw time series of all variables."""
+    seg_len = WELCH_SEGMENT_MIN*60*SAMPLE_RATE[device]
+    func = {wf.__name__: wf for wf in setup.window_functions}[WELCH_WINDOW]
+    freq, spectra = welch_spectrum(
+        iter_segments([timeseries_data[var] for var in variables[device]], seg_len, WELCH_OVERLAP),
+        sample_rate(timeseries_data["datetime"]), seg_len, func=func, workers=FFT_WORKERS,
+        n=len(timeseries_data["datetime"]))
+
+    spectra_data = {"frequencies": freq}
+    for var, spec in zip(variables[device], spectra):
+        spectra_data[f"{var}_spec"] = spec
+    return spectra_data
+
+@instrumented()
+def smooth_data(device: str, spectra_data: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Stage 4: spectra smoothed with rolling mean."""
+    return {f"{var}_spec_smooth": roll_mean(spectra_data[f"{var}_spec"], win_len=KERNEL_SIZE)
+            for var in variables[device]}
+
+@instrumented()
+def binned_data(device: str, spectra_data: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Stage 4: spectra averaged in log-spaced frequency bins (mean, variance
+    and number of FFT bins per bin)."""
+    binned_data = {}
+    for var in variables[device]:
+        binned = log_bin_spectrum(spectra_data["frequencies"], spectra_data[f"{var}_spec"],
+                                  n_bins=SPECTRUM_BINS)
+        for field in ["from", "to", "frequencies", "count"]:
+            binned_data[field] = binned[field]
+        binned_data[f"{var}_mean"] = binned["mean"]
+        binned_data[f"{var}_var"] = binned["var"]
+    return binned_data
+
+@instrumented()
+def ti_data(device: str, data: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Stage 5: turbulence intensity."""
+    turb_data = {}
+    for var in variables[device]:
+        ti = turbulente_intensitaet_bins(data["datetime"], data[var], interval_min=TI_INTERVAL_MIN)
+        turb_data["from"] = ti["from"]
+        turb_data["to"] = ti["to"]
+        turb_data[f"{var}_abs"] = ti["abs"]
+        turb_data[f"{var}_rel"] = ti["rel"]
+    return turb_data
+
+def stages(device: str, period: str) -> dict[str, Stage]:
+    """
+    Return the stages of a period and device. Each stage is keyed by the
+    inputs it depends on (raw-file fingerprint, period bounds, parameters
+    from setup.py) and the keys of its upstream stages, so only stages
+    downstream of a change are recomputed.
+    """
+    p = get_period(period)
+    name = f"{period}_{device}"
+
+    # the raw data is cached by parse itself
+    load = Stage(f"{name}_load", [file_fingerprint(p.raw_file(device)), p.start, p.end,
+                                  variables[device], SAMPLE_RATE[device], CODE, SETTINGS],
+                 lambda: load_data(device, period), cache=False)
+    preprocess = Stage(f"{name}_preprocess", [TAPERING_SIZE],
+                       lambda data: preprocess_data(device, data), load)
+    periodogram = Stage(f"{name}_periodogram", [],
+                        lambda ts: periodogram_data(device, ts), preprocess)
+
+    # the periodogram is also used for the comparison of the devices
+    if SPECTRUM_METHOD[device] == "periodogram":
+        spectrum = periodogram
+    elif SPECTRUM_METHOD[device] == "welch":
+        spectrum = Stage(f"{name}_welch", [WELCH_SEGMENT_MIN, WELCH_OVERLAP, WELCH_WINDOW,
+                                           SAMPLE_RATE[device]],
+                         lambda ts: welch_data(device, ts), preprocess)
+    else:
+        raise ValueError(f"Invalid spectrum method '{SPECTRUM_METHOD[device]}'.")
+
+    smooth = Stage(f"{name}_smooth", [KERNEL_SIZE],
+                   lambda spectra: smooth_data(device, spectra), spectrum)
+    binned = Stage(f"{name}_binned", [SPECTRUM_BINS],
+                   lambda spectra: binned_data(device, spectra), spectrum)
+    ti = Stage(f"{name}_ti", [TI_INTERVAL_MIN],
+               lambda data: ti_data(device, data), load)
+
+    return {"load": load, "preprocess": preprocess, "periodogram": periodogram,
+            "spectrum": spectrum, "smooth": smooth, "binned": binned, "ti": ti}
+
+def calculate(device: str, period: str) -> None:
+    """Run all stages of a period and device and save the results."""
+    st = stages(device, period)
+
+    # time series
+    timeseries_data = st["preprocess"].result()
+    write_results("timeseries_data", f"{period}_{device}_preprocessed_data", timeseries_data)
+    if TIMESERIES_STORE:
+        write_series(period, device, timeseries_data["datetime"],
+                     {k: v for k, v in timeseries_data.items() if k != "datetime"},
+                     SAMPLE_RATE[device])
+
+    # spectra and smoothed spectra
+    if SAVE_FULL_SPECTRA:
+        spectra_data, smoothed_data = st["spectrum"].result(), st["smooth"].result()
+        spec_data = {"frequencies": spectra_data["frequencies"]}
+        for var in variables[device]:
+            spec_data[f"{var}_spec"] = spectra_data[f"{var}_spec"]
+            spec_data[f"{var}_spec_smooth"] = smoothed_data[f"{var}_spec_smooth"]
+        write_results("spectra_data", f"{period}_{device}_spectrum_data", spec_data)
+
+    # spectra in log-spaced frequency bins
+    write_results("spectra_data", f"{period}_{device}_binned_spectrum_data", st["binned"].result())
+
+    # turbulence intensity
+    write_results("turbulence_intensity_data", f"{period}_{device}_turbulence_intensity_data",
+                  st["ti"].result())
+
+@instrumented()
+def comparison_data(expe_spectra: dict[str, np.ndarray],
+                    sonic_data: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """
+    Stage: EXPE and SONIC spectra at the same frequencies. The detrended
+    SONIC time series are decimated to the EXPE sample rate (polyphase
+    filter) before the FFT and their spectra are interpolated onto the
+    frequencies of the EXPE spectrum, as the sample sizes can differ slightly.
+    """
+    dt, y = resample_signal(
+        sonic_data["datetime"],
+        np.stack([sonic_data[f"{var}_det"] for var in variables["SONIC"]]),
+        SAMPLE_RATE["EXPE"])
+    freq, spectra = calc_spectrum(dt, taper_signal(y, TAPERING_SIZE), workers=FFT_WORKERS)
+    spectra = align_spectrum(freq, spectra, expe_spectra["frequencies"])
+
+    comparison = {"frequencies": expe_spectra["frequencies"],
+                  "EXPE_t": expe_spectra["t_spec"]}
+    for var, spec in zip(variables["SONIC"], spectra):
+        comparison[f"SONIC_{var}"] = spec
+    return comparison
+
+def compare(period: str) -> None:
+    """Store the spectra of EXPE and SONIC data in one file. The EXPE
+    periodogram and the SONIC time series are reused from the stage cache."""
+
+    comparison = Stage(f"{period}_comparison", [SAMPLE_RATE["EXPE"], CODE], comparison_data,
+                       stages("EXPE", period)["periodogram"],
+                       stages("SONIC", period)["preprocess"])
+
+    write_results("spectra_data", f"{period}_comparison_spectrum_data", comparison.result())
+
+
+def calculate_files(device: str, period: str) -> tuple[list[str], list[str]]:
+    """Return the input and output files of calculate."""
+    p = get_period(period)
+    raw_fn = p.expe_fn if device == "EXPE" else p.sonic_fn
+
+    outputs = [results_fn("timeseries_data", f"{period}_{device}_preprocessed_data"),
+               results_fn("spectra_data", f"{period}_{device}_binned_spectrum_data"),
+               results_fn("turbulence_intensity_data", f"{period}_{device}_turbulence_intensity_data")]
+    if SAVE_FULL_SPECTRA:
+        outputs.append(results_fn("spectra_data", f"{period}_{device}_spectrum_data"))
+    return [fn for fn in [raw_fn] if fn] + DEPENDENCIES, outputs
+
+def compare_files(period: str) -> tuple[list[str], list[str]]:
+    """Return the input and output files of compare."""
+    p = get_period(period)
+    return [fn for fn in [p.expe_fn, p.sonic_fn] if fn] + DEPENDENCIES, \
+        [results_fn("spectra_data", f"{period}_comparison_spectrum_data")]
+
 
-print("Process EXPE and SONIC data...")
-for period in all_puos:
-    
-    comparison = pd.DataFrame()    
-    
-    # EXPE
-    data = parse_data("EXPE", period)
-    dt = data["Datetime"].to_numpy()
-    t = data["t"].to_numpy()
-    
-    comparison["frequencies"] = calc_spectrum(dt, taper_signal(detrend_signal(t), perc=0.1))[0]
-    comparison["EXPE_t"] = calc_spectrum(dt, taper_signal(detrend_signal(t), perc=0.1))[1]
-    
-    n_expe = len(comparison)
-    
-    # SONIC
-    data = parse_data("SONIC", period)
-    dt = data["Datetime"].to_numpy()
-    t = data["t"].to_numpy()
-    wind_z = data["wind_z"].to_numpy()
-    wind_h = data["wind_h"].to_numpy()
-    
-    comparison["SONIC_t"] = calc_spectrum(dt, taper_signal(detrend_signal(t), perc=0.1))[1][:n_expe]
-    comparison["SONIC_wind_z"] = calc_spectrum(dt, taper_signal(detrend_signal(wind_z), perc=0.1))[1][:n_expe]
-    comparison["SONIC_wind_h"] = calc_spectrum(dt, taper_signal(detrend_signal(wind_h), perc=0.1))[1][:n_expe]
-
-    # save to csv
-    comparison.to_csv(f"data/spectra_data/{period}_comparison_spectrum_data.csv", index=False)
-
-print("Done!")
\ No newline at end of file
+if __name__ == "__main__":
+    import sys
+    from cli import main
+    sys.exit(main(["calculate", *sys.argv[1:]]))
@@ -1,161 +1,244 @@
-import pandas as pd
+import os
+import numpy as np
 import warnings
 warnings.filterwarnings("ignore")
 
-from setup import SAMPLE_RATE, variables, labels, all_puos, metadata
+import setup
+import instrument
+from setup import SAMPLE_RATE, MITTELUNGSINTERVALL, PERIODS_FN, WINDOWS_MIN, variables, labels, \
+    all_puos, metadata, TIMESERIES_STORE
 from parse import get_var
+from periods import periods, get_period
+from results import results_fn, find_results, read_results, write_results
+from store import has_series, read_window
 
-from plot import plot_ts, plot_spectrum, plot_spectrum_comp, \
-    plot_spectrum_comp, plot_win, plot_win_influence, plot_avg, \
-    plot_temporal_coverage, plot_patterns, plot_mean_corr, \
-    plot_turb_intensity, plot_spectrum_comp_all, plot_error_metrics
-    
+# plot.py (pandas, matplotlib) is imported by the jobs on first use
 
-# plotting agenda
-PLOT_TEMPORAL_COVERAGE          = False
-PLOT_TIME_SERIES                = False
-PLOT_SPECTRUM_DATA              = True
-PLOT_WINDOW_FUNCTION_INFLUENCE  = False
-PLOT_AVERAGING                  = False
-PLOT_TURBULENCE_INTENSITY       = False
 
-TEST_MODE                       = False
-all_puos = ["PUO_01"] if TEST_MODE else all_puos
+# files the plots depend on besides the data
+DEPENDENCIES = [__file__, os.path.join(os.path.dirname(__file__), "plot.py"), setup.__file__,
+                PERIODS_FN]
 
-# -----------------------------------------------------------------------------
-# plot temporal coverage
-# -----------------------------------------------------------------------------
-
-if PLOT_TEMPORAL_COVERAGE:
-    print("Plot temporal coverage...")
-    plot_temporal_coverage()
-
-# -----------------------------------------------------------------------------
-# plot time series
-# -----------------------------------------------------------------------------
-
-if PLOT_TIME_SERIES:
-    print("Plot time series...")
-    for period in all_puos:
-        for device in ["EXPE", "SONIC"]:
-            print("\t", period, "&", device)
-        
-            _, _, start_datetime, end_datetime, date, _ = metadata(period)
-
-            for var in variables[device]:
-                plot_ts(
-                    x=get_var(device, period, "Datetime"),
-                    y=get_var(device, period, var),
-                    fn=f"{period}_{device}_{var}", 
-                    title = f"""{labels[var]}\n{date}: {start_datetime[10:-3]} - {end_datetime[10:-3]}\n({device}, {SAMPLE_RATE[device]} Hz)"""
-                    )
-
-# -----------------------------------------------------------------------------
-# plot spectrum data
-# -----------------------------------------------------------------------------
+# error metrics of the averaging in long form: PUO, Device, Variable, Window (min), Metric, Value
+# (data/avg_error_metrics.csv: in RESULTS_DIR itself)
+ERROR_METRICS = ("", "avg_error_metrics")
+ERROR_METRICS_FN = results_fn(*ERROR_METRICS)
 
-if PLOT_SPECTRUM_DATA:
-    print("Plot spectrum data...")
-    for period in all_puos:
-    #     _, _, start_datetime, end_datetime, date, _ = metadata(period)
-        
-    #     for device in ["EXPE", "SONIC"]:
-    #         print("\t", period, "&", device)
-            
-    #         # plot spectrum
-    #         for var in variables[device]:
-    #             plot_spectrum(
-    #                 x=get_var(device, period, "Datetime"),
-    #                 y=get_var(device, period, var),
-    #                 fn=f"{period}_{device}_{var}",
-    #                 ylabel=labels[var], 
-    #                 title = f"""{labels[var]}\n{date}: {start_datetime[10:-3]} - {end_datetime[10:-3]}\n({device}, {SAMPLE_RATE[device]} Hz)"""
-    #                 )
-        
-        # plot comparison normalized spectra
-        plot_patterns(period)
-    
-    # plot comparison smoothed spectra
-    plot_spectrum_comp("EXPE")
-    plot_spectrum_comp("SONIC")
-    plot_spectrum_comp_all()
-    # plot_wind_spectrum_comp()
-    
-    # plot spectra correlation matrix
-    plot_mean_corr()
 
-# -----------------------------------------------------------------------------
-# plot window function influence
-# -----------------------------------------------------------------------------
+def title(period: str, device: str, var: str) -> str:
+    """Return the title of a plot of a variable in a period."""
+    _, _, start_datetime, end_datetime, date, _ = metadata(period)
+    return f"""{labels[var]}\n{date}: {start_datetime[10:-3]} - {end_datetime[10:-3]}\n({device}, {SAMPLE_RATE[device]} Hz)"""
 
-if PLOT_WINDOW_FUNCTION_INFLUENCE:
-    print("Plot window function influence...")
-
-    # plot window functions
-    plot_win()
-
-    # plot influence of window functions on spectra
-    for period in all_puos:
-        _, _, start_datetime, end_datetime, date, _ = metadata(period)
-        
-        for device in ["EXPE", "SONIC"]:
-            print("\t", period, "&", device)
-            
-            for var in variables[device]:
-                plot_win_influence(
-                        x=get_var(device, period, "Datetime"),
-                        y=get_var(device, period, var),
-                        title=f"""{labels[var]}\n{date}: {start_datetime[10:-3]} - {end_datetime[10:-3]}\n({device}, {SAMPLE_RATE[device]} Hz)""",
-                        fn=f"wf_{period}_{device}_{var}"
-                        )
+def series(period: str, device: str, var: str) -> tuple[np.ndarray, np.ndarray]:
+    """Return the datetime and a variable of a period: from the time series
+    store if main_calculation.py stored it (TIMESERIES_STORE), otherwise
+    from the raw file."""
+    if TIMESERIES_STORE and has_series(period, device):
+        p = get_period(period)
+        return read_window(period, device, var, p.start_datetime, p.end_datetime)
+    return get_var(device, period, "Datetime"), get_var(device, period, var)
 
 # -----------------------------------------------------------------------------
-# plot averaging
+# jobs of one period and device
 # -----------------------------------------------------------------------------
 
-if PLOT_AVERAGING:
-    print("Plot averaging...")
-    error_metrics = pd.DataFrame()
-    
-    for period in all_puos:
-        _, _, start_datetime, end_datetime, date, _ = metadata(period)
-        
-        for device in ["EXPE", "SONIC"]:
-            print("\t", period, "&", device)
-
-
-
-            for var in variables[device]:
-                error_metrics_dict = plot_avg(
-                    x=get_var(device, period, "Datetime"),
-                    y=get_var(device, period, var),
-                    device=device,
-                    title=f"""{labels[var]}\n{date}: {start_datetime[10:-3]} - {end_datetime[10:-3]}\n({device}, {SAMPLE_RATE[device]} Hz)""",
-                    fn=f"avg_{period}_{device}_{var}"
-                    )
-                
-                error_metrics_dict["PUO"] = period
-                error_metrics_dict["Device"] = device
-                error_metrics_dict["Variable"] = var
-                
-                error_metrics = error_metrics.append(error_metrics_dict, ignore_index=True)
-                
-    error_metrics.to_csv("data/avg_error_metrics.csv", index=False)
-
-    plot_error_metrics()
+def plot_job(name: str, *args) -> None:
+    """Run the plot function name of plot.py (recorded under its name by
+    cli.py --instrument)."""
+    import plot
+    instrument.call(getattr(plot, name), *args)
+
+def time_series_job(period: str, device: str, variables: list[str]) -> None:
+    from plot import plot_ts
+    for var in variables:
+        x, y = series(period, device, var)
+        plot_ts(
+            x=x,
+            y=y,
+            fn=f"{period}_{device}_{var}",
+            title=title(period, device, var)
+            )
+
+def window_function_influence_job(period: str, device: str, variables: list[str]) -> None:
+    from plot import plot_win_influence
+    for var in variables:
+        x, y = series(period, device, var)
+        plot_win_influence(
+                x=x,
+                y=y,
+                title=title(period, device, var),
+                fn=f"wf_{period}_{device}_{var}"
+                )
+
+def averaging_job(period: str, device: str, variables: list[str], figures: bool = True) -> list[dict]:
+    """Plot the averaging (if figures) and return the error metrics (one row
+    per window and metric)."""
+    from plot import plot_avg, averaging_data
+    rows = []
+    for var in variables:
+        x, y = series(period, device, var)
+        data = averaging_data(y, device)
+        if figures:
+            plot_avg(
+                x=x,
+                y=y,
+                device=device,
+                title=title(period, device, var),
+                fn=f"avg_{period}_{device}_{var}",
+                data=data
+                )
+
+        for metric, values in data["metrics"].items():
+            for window, value in zip(WINDOWS_MIN, values):
+                rows.append({"PUO": period, "Device": device, "Variable": var,
+                             "Window": window, "Metric": metric, "Value": float(value)})
+    return rows
+
+def save_error_metrics(rows: list[dict]) -> None:
+    """Save the error metrics of the averaging. Rows of other periods,
+    devices and variables already in the file are kept, the rows are
+    sorted by period and device (stable diffs of the csv-file)."""
+    if not rows:
+        return
+    import pandas as pd
+    error_metrics = pd.DataFrame(rows)
+    if os.path.exists(ERROR_METRICS_FN):
+        old = read_results(*ERROR_METRICS)
+        key = ["PUO", "Device", "Variable"]
+        replaced = old.set_index(key).index.isin(error_metrics.set_index(key).index)
+        error_metrics = pd.concat([old[~replaced], error_metrics], ignore_index=True)
+    error_metrics = error_metrics.sort_values(["PUO", "Device"], kind="stable", ignore_index=True)
+    write_results(*ERROR_METRICS, error_metrics)
 
 # -----------------------------------------------------------------------------
-# plot turbulence intensity
+# jobs of a plot type
 # -----------------------------------------------------------------------------
 
-if PLOT_TURBULENCE_INTENSITY:
-    print("Plot turbulence intensity...")
-    plot_turb_intensity(which="abs")
-    plot_turb_intensity(which="rel")
-
-# -----------------------------------------------------------------------------
-
-print("Done!")
-
-# print(f"\tTurbulente Intensität Horizontalwind: {turbulente_intensitaet(y=timeseries_data['wind_h'])}")
-# print(f"\tTurbulente Intensität Vertikalwind {turbulente_intensitaet(y=timeseries_data['wind_z'])}")
+def _raw_files(period: str, device: str) -> list[str]:
+    p = get_period(period)
+    fn = p.expe_fn if device == "EXPE" else p.sonic_fn
+    return [fn] if fn else []
+
+def _results(kind: str, names: list[str]) -> list[str]:
+    return [find_results(kind, name) for name in names]
+
+def plot_tasks(
+        plot_type: str,
+        puos: list[str],
+        devices: list[str],
+        variables_filter: list[str] | None = None
+        ) -> list[tuple[tuple, list[str], list[str]]]:
+    """
+    Return the jobs (see jobs.py) of a plot type with their input and output
+    files as (job, inputs, outputs) in the render profile of the run
+    (see plot.set_render_profile). Per-variable plots are only made for
+    the variables in variables_filter (all if None). Plots of several
+    periods always show all PUOs of setup.all_puos.
+    """
+    from plot import figure_fn
+
+    def selected(device: str) -> list[str]:
+        return [var for var in variables[device]
+                if variables_filter is None or var in variables_filter]
+
+    pairs = [(period, device) for period in puos for device in devices if selected(device)]
+    tasks = []
+
+    if plot_type == "coverage":
+        tasks.append((
+            ("temporal coverage", plot_job, ("plot_temporal_coverage",)),
+            [fn for day in periods().days() for fn in [day.expe_fn, day.sonic_fn] if fn]
+            + DEPENDENCIES,
+            ["plots/temporal_coverage/temporal_coverage.png"]))
+
+    elif plot_type == "timeseries":
+        for period, device in pairs:
+            tasks.append((
+                (f"{period} & {device}", time_series_job, (period, device, selected(device))),
+                _raw_files(period, device) + DEPENDENCIES,
+                [f"plots/preprocessing/preprocess_{period}_{device}_{var}.png"
+                 for var in selected(device)]))
+
+    elif plot_type == "spectra":
+        comparisons = _results("spectra_data", [f"{period}_comparison_spectrum_data"
+                                                for period in all_puos])
+        # binned spectra, binned from the full spectra if missing (see plot.binned_spectrum)
+        binned = {device: _results("spectra_data", [f"{period}_{device}_{kind}_data"
+                                                   for period in all_puos
+                                                   for kind in ["binned_spectrum", "spectrum"]])
+                  for device in ["EXPE", "SONIC"]}
+
+        # comparison normalized spectra
+        for period in puos:
+            tasks.append((
+                (period, plot_job, ("plot_patterns", period)),
+                _results("spectra_data", [f"{period}_comparison_spectrum_data"]) + DEPENDENCIES,
+                [f"plots/spectra_comparison/spectra_variable_comparison_{period}.png",
+                 f"plots/spectra_comparison/spectra_variable_comparison_corr_{period}.png"]))
+
+        # comparison smoothed spectra
+        for device in devices:
+            tasks.append((
+                (device, plot_job, ("plot_spectrum_comp", device)),
+                binned[device] + DEPENDENCIES,
+                [f"plots/spectra_comparison/spectra_temporal_comparison_{device}_{var}_spec.png"
+                 for var in variables[device]]))
+        tasks.append((
+            ("EXPE & SONIC", plot_job, ("plot_spectrum_comp_all",)),
+            binned["EXPE"] + binned["SONIC"] + DEPENDENCIES,
+            ["plots/spectra_comparison/spectra_temporal_comparison.png"]))
+
+        # spectra correlation matrix
+        tasks.append((
+            ("correlation matrix", plot_job, ("plot_mean_corr",)),
+            comparisons + DEPENDENCIES,
+            ["plots/other/correlation_mean.png"]))
+
+    elif plot_type == "window":
+        tasks.append((
+            ("window functions", plot_job, ("plot_win",)),
+            DEPENDENCIES,
+            ["plots/sensitivity_wf/window_functions.png"]))
+        for period, device in pairs:
+            tasks.append((
+                (f"{period} & {device}", window_function_influence_job, (period, device, selected(device))),
+                _raw_files(period, device) + DEPENDENCIES,
+                [f"plots/sensitivity_wf/wf_{period}_{device}_{var}.png" for var in selected(device)]))
+
+    elif plot_type == "averaging":
+        for period, device in pairs:
+            tasks.append((
+                (f"{period} & {device}", averaging_job, (period, device, selected(device))),
+                _raw_files(period, device) + DEPENDENCIES,
+                [f"plots/averaging/avg_{period}_{device}_{var}_{MITTELUNGSINTERVALL}min.png"
+                 for var in selected(device)]))
+
+    elif plot_type == "turbulence":
+        ti = _results("turbulence_intensity_data", [f"{period}_{device}_turbulence_intensity_data"
+                                                    for period in all_puos for device in ["EXPE", "SONIC"]])
+        for which in ["abs", "rel"]:
+            tasks.append((
+                (which, plot_job, ("plot_turb_intensity", which)),
+                ti + DEPENDENCIES,
+                [f"plots/turbulent_intensity/turbulent_intensity_{which}_without_PUO05.png"]))
+
+    else:
+        raise ValueError(f"Invalid plot type '{plot_type}'.")
+
+    # file names of the render profile
+    return [(job, inputs, [figure_fn(fn) for fn in outputs]) for job, inputs, outputs in tasks]
+
+def error_metrics_task() -> tuple[tuple, list[str], list[str]]:
+    """Return the job plotting the saved error metrics (after the averaging
+    jobs) with its input and output files."""
+    from plot import figure_fn
+    return (("error metrics", plot_job, ("plot_error_metrics", *ERROR_METRICS)),
+            [ERROR_METRICS_FN] + DEPENDENCIES,
+            [figure_fn(f"plots/other/error_metrics_{MITTELUNGSINTERVALL}min.png")])
+
+
+if __name__ == "__main__":
+    import sys
+    from cli import main
+    sys.exit(main(["plot", *sys.argv[1:]]))
@@ -1,74 +1,363 @@
-import pandas as pd
+from __future__ import annotations
+
+import io
+import os
+from functools import lru_cache
+from typing import TYPE_CHECKING
 import numpy as np
 
-from setup import metadata
+from setup import CACHE_DIR, PARSE_CACHE, RAW_FILES_IN_MEMORY, SEEK_MIN_FILE_SIZE
+from files import atomic_write
+from periods import get_period
+from instrument import instrumented
+
+# pandas is only imported to parse raw files, runs using the cache do not load it
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# bump when the parsed columns or their derivation change
+_CACHE_VERSION = 2
 
+# raw file layout: number of header lines, position of "YYYY-MM-DD?HH:MM" in each
+# line, columns returned by the parser and offset of the logger clock to UTC
+_HEADER_LINES = {"EXPE": 1, "SONIC": 4}
+_MINUTE_KEY = {"EXPE": (0, 16), "SONIC": (1, 17)}
+_COLUMNS = {"EXPE": ["Datetime", "t"], "SONIC": ["Datetime", "t", "wind_h", "wind_z"]}
+_CLOCK_OFFSET = {"EXPE": np.timedelta64(0, "h"), "SONIC": np.timedelta64(1, "h")}
 
+
+@instrumented()
 def parse_data(
-        device: str, 
+        device: str,
         period: str
         ) -> pd.DataFrame | None:
-    expe_fn, sonic_fn, start_datetime, end_datetime, _, _ = metadata(period)
-    
+    p = get_period(period)
+
     if device == "EXPE":
-        return _parse_expe(expe_fn, start_datetime, end_datetime)
+        return _parse_expe(p.raw_file("EXPE"), p.start_datetime, p.end_datetime)
     elif device == "SONIC":
-        return _parse_sonic(sonic_fn, start_datetime, end_datetime)
+        return _parse_sonic(p.raw_file("SONIC"), p.start_datetime, p.end_datetime)
     else:
         raise ValueError(f"Invalid device '{device}'.")
 
+@instrumented()
 def get_var(
         device: str,
         period: str,
         var: str
         ) -> np.ndarray:
-    """Return a variable for certain period and measuring device as array."""
-    df = parse_data(device, period)
-    return df[var].to_numpy()
+    """Return a variable for certain period and measuring device as array.
+    The array is a read-only view into the parsed raw file."""
+    p = get_period(period)
+    cols = _period_columns(device, p.raw_file(device), p.start_datetime, p.end_datetime)
+    return cols[var]
 
-def _parse_expe(expe_fn: str, start_datetime: str, end_datetime: str) -> pd.DataFrame:
+def file_fingerprint(fn: str) -> tuple[int, int]:
+    """Return size (bytes) and modification time (ns) of a file."""
+    stat = os.stat(fn)
+    return stat.st_size, stat.st_mtime_ns
+
+def _cache_fn(fn: str) -> str:
+    """Return the path of the columnar cache file of a raw file."""
+    return os.path.join(CACHE_DIR, os.path.basename(fn) + ".npz")
+
+def _read_cache(fn: str) -> dict[str, np.ndarray] | None:
+    """Return the cached columns of a raw file or None if the cache is stale."""
+    cache_fn = _cache_fn(fn)
+    if not os.path.exists(cache_fn):
+        return None
+
+    with np.load(cache_fn) as cache:
+        header = cache["__header__"]
+        if tuple(header) != (_CACHE_VERSION, *file_fingerprint(fn)):
+            return None
+        return {k: cache[k] for k in cache.files if k != "__header__"}
+
+def _write_cache(fn: str, cols: dict[str, np.ndarray]) -> None:
+    """Store the parsed columns of a raw file next to its fingerprint."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cache_fn = _cache_fn(fn)
+    header = np.array([_CACHE_VERSION, *file_fingerprint(fn)], dtype=np.int64)
+
+    # parallel jobs may parse the same raw file
+    atomic_write(cache_fn, lambda f: np.savez(f, __header__=header, **cols))
+
+def _load_raw(device: str, fn: str) -> dict[str, np.ndarray]:
+    """Return all columns of a raw file. Each file is parsed once per process
+    (and once per change if PARSE_CACHE is set) and kept in memory."""
+    return _load_raw_in_memory(device, fn, file_fingerprint(fn))
+
+@lru_cache(maxsize=RAW_FILES_IN_MEMORY)
+def _load_raw_in_memory(
+        device: str,
+        fn: str,
+        fingerprint: tuple[int, int]
+        ) -> dict[str, np.ndarray]:
+    """Load the columns of a raw file sorted by time. The fingerprint is part
+    of the cache key, so a changed file is loaded again."""
+    cols = _sort_by_time(_load_raw_from_disk(device, fn))
+
+    # the columns are shared between all callers
+    for v in cols.values():
+        v.setflags(write=False)
+    return cols
+
+def _sort_by_time(cols: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Sort all columns by time (the logger clocks may step back a few seconds)."""
+    dt = cols["Datetime"]
+    if np.any(dt[1:] < dt[:-1]):
+        order = np.argsort(dt, kind="stable")
+        cols = {k: v[order] for k, v in cols.items()}
+    return cols
+
+@instrumented()
+def _load_raw_from_disk(device: str, fn: str) -> dict[str, np.ndarray]:
+    """Return all columns of a raw file, parsed once and cached on disk."""
+    if PARSE_CACHE:
+        cols = _read_cache(fn)
+        if cols is not None:
+            return cols
+
+    if device == "EXPE":
+        cols = _read_expe(fn)
+    else:
+        cols = _read_sonic(fn)
+
+    if PARSE_CACHE:
+        _write_cache(fn, cols)
+    return cols
+
+def _period_columns(
+        device: str,
+        fn: str,
+        start_datetime: str,
+        end_datetime: str
+        ) -> dict[str, np.ndarray]:
+    """Return the columns of a raw file between start and end datetime. Large
+    files are read only in the requested time range."""
+    if os.path.getsize(fn) >= SEEK_MIN_FILE_SIZE:
+        cols = _read_period(device, fn, start_datetime, end_datetime)
+    else:
+        cols = _load_raw(device, fn)
+    return _slice_period(cols, start_datetime, end_datetime)
+
+def _slice_period(
+        cols: dict[str, np.ndarray],
+        start_datetime: str,
+        end_datetime: str
+        ) -> dict[str, np.ndarray]:
+    """Return views of all rows between start and end datetime (inclusive)."""
+    dt = cols["Datetime"]
+    i_start = np.searchsorted(dt, np.datetime64(start_datetime), side="left")
+    i_end = np.searchsorted(dt, np.datetime64(end_datetime), side="right")
+    return {k: v[i_start:i_end] for k, v in cols.items()}
+
+def _index_fn(fn: str) -> str:
+    """Return the path of the byte-offset index file of a raw file."""
+    return os.path.join(CACHE_DIR, os.path.basename(fn) + ".idx.npz")
+
+def _offset_index(device: str, fn: str) -> tuple[np.ndarray, np.ndarray, int]:
+    """Return the byte-offset index of a raw file.
+
+    The index holds the first minute of each logged minute (logger clock) and
+    the byte offset of its first line as well as the number of bytes indexed
+    so far. It is stored next to the parsed-file cache and only the lines
+    appended since the last call are scanned.
+    """
+    index_fn = _index_fn(fn)
+    size = os.path.getsize(fn)
+    with open(fn, "rb") as f:
+        head = f.read(256)
+
+    minutes = np.empty(0, dtype="datetime64[m]")
+    offsets = np.empty(0, dtype=np.int64)
+    scanned = None
+    if os.path.exists(index_fn):
+        with np.load(index_fn) as index:
+            # a shorter file or a different head means the file was replaced
+            if index["head"].tobytes() == head and int(index["scanned"]) <= size:
+                minutes, offsets = index["minutes"], index["offsets"]
+                scanned = int(index["scanned"])
+
+    if scanned is None:
+        with open(fn, "rb") as f:
+            for _ in range(_HEADER_LINES[device]):
+                f.readline()
+            scanned = f.tell()
+
+    if scanned < size:
+        new_minutes, new_offsets, scanned = _scan_minutes(
+            device, fn, scanned, minutes[-1] if len(minutes) else None)
+        minutes = np.concatenate([minutes, new_minutes])
+        offsets = np.concatenate([offsets, new_offsets])
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        atomic_write(index_fn, lambda f: np.savez(
+            f, minutes=minutes, offsets=offsets, scanned=scanned,
+            head=np.frombuffer(head, dtype=np.uint8)))
+
+    return minutes, offsets, scanned
+
+def _scan_minutes(
+        device: str,
+        fn: str,
+        start: int,
+        last_minute: np.datetime64 | None,
+        block_size: int = 2**24
+        ) -> tuple[np.ndarray, np.ndarray, int]:
+    """Find the byte offsets where a new minute starts, beginning at byte start.
+    Only complete lines are indexed. Returns minutes, offsets and the offset
+    after the last complete line."""
+    key_start, key_end = _MINUTE_KEY[device]
+    key_pos = np.arange(key_start, key_end)
+    minutes, offsets = [], []
+    last_key = None
+
+    with open(fn, "rb") as f:
+        f.seek(start)
+        while True:
+            block = f.read(block_size)
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord("\n"))
+            if len(newlines) == 0:
+                break
+            block = block[:newlines[-1] + 1]
+            line_starts = np.concatenate([[0], newlines[:-1] + 1])
+
+            # compare the minute part of all lines and decode only where it changes
+            buf = np.frombuffer(block + b" " * key_end, dtype=np.uint8)
+            keys = buf[line_starts[:, None] + key_pos].copy().view(f"S{len(key_pos)}")[:, 0]
+            changed = np.flatnonzero(np.concatenate([[keys[0] != last_key], keys[1:] != keys[:-1]]))
+            last_key = keys[-1]
+
+            for i in changed:
+                try:
+                    minute = np.datetime64(keys[i].decode().replace(";", " "), "m")
+                except ValueError:
+                    continue
+                # jumps back of the logger clock do not open a new minute
+                if last_minute is None or minute > last_minute:
+                    minutes.append(minute)
+                    offsets.append(start + line_starts[i])
+                    last_minute = minute
+
+            start += len(block)
+            f.seek(start)
+
+    return (np.array(minutes, dtype="datetime64[m]"),
+            np.array(offsets, dtype=np.int64), start)
+
+@instrumented()
+def _read_period(
+        device: str,
+        fn: str,
+        start_datetime: str,
+        end_datetime: str
+        ) -> dict[str, np.ndarray]:
+    """Parse only the bytes of a raw file covering the time period (with a
+    margin of one minute for small jumps of the logger clock)."""
+    minutes, offsets, scanned = _offset_index(device, fn)
+
+    margin = np.timedelta64(1, "m")
+    first = np.datetime64(start_datetime, "m") + _CLOCK_OFFSET[device] - margin
+    last = np.datetime64(end_datetime, "m") + _CLOCK_OFFSET[device] + 2*margin
+
+    i_first = np.searchsorted(minutes, first, side="left")
+    i_last = np.searchsorted(minutes, last, side="left")
+    byte_start = offsets[i_first] if i_first < len(offsets) else scanned
+    byte_end = offsets[i_last] if i_last < len(offsets) else scanned
+
+    if byte_start >= byte_end:
+        return {k: np.empty(0, dtype="datetime64[ns]" if k == "Datetime" else float)
+                for k in _COLUMNS[device]}
+
+    if device == "EXPE":
+        cols = _read_expe(fn, (byte_start, byte_end))
+    else:
+        cols = _read_sonic(fn, (byte_start, byte_end))
+    return _sort_by_time(cols)
+
+def _open_range(
+        fn: str,
+        byte_range: tuple[int, int] | None,
+        header_lines: int
+        ) -> str | io.BytesIO:
+    """Return the file name or, if a byte range is given, the header lines and
+    the bytes in this range as buffer."""
+    if byte_range is None:
+        return fn
+
+    with open(fn, "rb") as f:
+        header = b"".join(f.readline() for _ in range(header_lines))
+        f.seek(byte_range[0])
+        data = f.read(byte_range[1] - byte_range[0])
+    return io.BytesIO(header + data)
+
+def _read_expe(
+        expe_fn: str,
+        byte_range: tuple[int, int] | None = None
+        ) -> dict[str, np.ndarray]:
     """Parse the data from the csv-file using sensor 0."""
-    
-    df = pd.read_csv(expe_fn, delimiter=";")
+    import pandas as pd
 
-    sensor0 = df.loc[df['Module Command'] == 0]
-    rename_cols = {"Value2":"t", "Value3":"rh", "Value4":"p"}
-    type_cols = {'t': float, 'rh': float, 'p': float}
-    sensor0 = sensor0.rename(columns=rename_cols).astype(type_cols)
+    df = pd.read_csv(_open_range(expe_fn, byte_range, _HEADER_LINES["EXPE"]), delimiter=";",
+                     usecols=["Date", "Time", "Module Command", "Value2"])
 
-    sensor0["t"] = sensor0["t"]/100
-    sensor0["rh"] = sensor0["rh"]/1000
-    sensor0["p"] = sensor0["p"]/1000
+    sensor0 = (df["Module Command"] == 0).to_numpy()
+    t = df["Value2"].to_numpy()[sensor0].astype(float)/100
 
-    sensor0["Datetime"] = sensor0['Date'].astype(str) +" "+ sensor0["Time"]
-    sensor0["Datetime"] = pd.to_datetime(sensor0["Datetime"], format="%Y-%m-%d %H:%M:%S")
-    sensor0_flt = sensor0.loc[sensor0['Datetime'].between(start_datetime, end_datetime, inclusive="both")]
-    sensor0_flt = sensor0_flt[["Datetime", "t"]]
-    
-    return sensor0_flt
+    date = np.array(df["Date"].to_numpy()[sensor0], dtype="datetime64[D]")
+    time = _decode_hhmmss(df["Time"].to_numpy()[sensor0])
 
-def _calc_2d_wind(row)-> float:
-    """Calculate the horizontal wind speed from the 3 wind components."""
-    return np.sqrt(row["wind_x"]**2 + row["wind_y"]**2)
+    return {
+        "Datetime": date.astype("datetime64[ns]") + time,
+        "t": t
+        }
 
-def _parse_sonic(sonic_fn: str, start_datetime: str, end_datetime: str) ->  pd.DataFrame:
-    """Parse the data from the dat-file and calculate 2D and 3D wind speed."""
-    
-    df = pd.read_csv(sonic_fn, delimiter=",", usecols=[0,2,3,4,5], 
-                     names=["Datetime", "wind_x", "wind_y", "wind_z", "t"], skiprows=4)    
-    type_cols = {'wind_x': float, 'wind_y': float, 'wind_z': float, 't': float}
-    df = df.astype(type_cols)
-    df = df.dropna()
+def _parse_expe(expe_fn: str, start_datetime: str, end_datetime: str) -> pd.DataFrame:
+    """Return the EXPE data of a time period."""
+    import pandas as pd
+    return pd.DataFrame(_period_columns("EXPE", expe_fn, start_datetime, end_datetime))
 
-    # Convert local time (wihout summer time) to UTC
-    df["Datetime"] = pd.to_datetime(df["Datetime"], format="%Y-%m-%d %H:%M:%S")
-    df["Datetime"] = df["Datetime"] - pd.Timedelta(hours=1)
+def _read_sonic(
+        sonic_fn: str,
+        byte_range: tuple[int, int] | None = None
+        ) ->  dict[str, np.ndarray]:
+    """Parse the data from the dat-file and calculate the horizontal wind speed."""
+    import pandas as pd
 
-    df_flt = df.loc[df['Datetime'].between(start_datetime, end_datetime, inclusive="both")]
+    df = pd.read_csv(_open_range(sonic_fn, byte_range, _HEADER_LINES["SONIC"]),
+                     delimiter=",", usecols=[0,2,3,4,5], skiprows=4,
+                     names=["Datetime", "wind_x", "wind_y", "wind_z", "t"], na_values=["NAN"],
+                     dtype={"Datetime": object, "wind_x": float, "wind_y": float,
+                            "wind_z": float, "t": float})
+    dt = df["Datetime"].to_numpy()
+    wind_x = df["wind_x"].to_numpy()
+    wind_y = df["wind_y"].to_numpy()
+    wind_z = df["wind_z"].to_numpy()
+    t = df["t"].to_numpy()
 
-    # Calculate 2D and 3D wind speed speed
-    df_flt.loc[:, "wind_h"] = df_flt.apply(_calc_2d_wind, axis=1)
+    valid = ~(pd.isna(dt) | np.isnan(wind_x) | np.isnan(wind_y) | np.isnan(wind_z) | np.isnan(t))
 
-    df_flt = df_flt[["Datetime", "t", "wind_h", "wind_z"]]
+    # Convert local time (wihout summer time) to UTC
+    dt = np.array(dt[valid], dtype="datetime64[ns]") - _CLOCK_OFFSET["SONIC"]
 
-    return df_flt
\ No newline at end of file
+    return {
+        "Datetime": dt,
+        "t": t[valid],
+        "wind_h": np.hypot(wind_x[valid], wind_y[valid]),
+        "wind_z": wind_z[valid]
+        }
+
+def _decode_hhmmss(time: np.ndarray) -> np.ndarray:
+    """Decode time strings of the fixed format HH:MM:SS to time deltas."""
+    digits = np.asarray(time, dtype="S8").view(np.uint8).reshape(-1, 8).astype(np.int64) - ord("0")
+    seconds = (digits[:, 0]*10 + digits[:, 1])*3600 \
+        + (digits[:, 3]*10 + digits[:, 4])*60 \
+        + digits[:, 6]*10 + digits[:, 7]
+    return seconds.astype("timedelta64[s]").astype("timedelta64[ns]")
+
+def _parse_sonic(sonic_fn: str, start_datetime: str, end_datetime: str) ->  pd.DataFrame:
+    """Return the SONIC data of a time period."""
+    import pandas as pd
+    return pd.DataFrame(_period_columns("SONIC", sonic_fn, start_datetime, end_datetime))
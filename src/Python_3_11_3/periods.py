@@ -0,0 +1,209 @@
+import os
+import re
+import csv
+from functools import lru_cache
+from dataclasses import dataclass
+import numpy as np
+
+from setup import RAW_DATA_DIR, PERIODS_FN
+
+
+# raw file names (see README), the time in the name is the local time of the logger
+_RAW_FILE_PATTERN = {
+    "EXPE": re.compile(r"(?P<date>\d{8})-(?P<time>\d{4})-Log\.txt"),
+    "SONIC": re.compile(r"TOA5_.*\.Raw_(?P<date>\d{4}_\d{2}_\d{2})_(?P<time>\d{4})\.dat")
+    }
+_NAME_CLOCK_OFFSET = {"EXPE": np.timedelta64(0, "h"), "SONIC": np.timedelta64(1, "h")}
+_DAY_DIR_PATTERN = re.compile(r"\d{4}_\d{2}_\d{2}")
+
+
+@dataclass(frozen=True)
+class Period:
+    """A period under observation (PUO) or a whole measuring day."""
+    name: str
+    start: np.datetime64            # UTC, inclusive
+    end: np.datetime64              # UTC, inclusive
+    day: int                        # number of the measuring day (1, 2, ...)
+    expe_fn: str | None = None      # None if there is no raw file
+    sonic_fn: str | None = None
+    note: str = ""
+
+    @property
+    def start_datetime(self) -> str:
+        return str(self.start).replace("T", " ")
+
+    @property
+    def end_datetime(self) -> str:
+        return str(self.end).replace("T", " ")
+
+    @property
+    def date(self) -> str:
+        return self.start.astype("datetime64[D]").item().strftime("%d.%m.%Y")
+
+    def raw_file(self, device: str) -> str:
+        """Return the raw file of a device."""
+        if device == "EXPE":
+            fn = self.expe_fn
+        elif device == "SONIC":
+            fn = self.sonic_fn
+        else:
+            raise ValueError(f"Invalid device '{device}'.")
+        if fn is None:
+            raise FileNotFoundError(f"No {device} raw file for {self.name} ({self.date}).")
+        return fn
+
+    def metadata(self) -> tuple:
+        """Return the tuple of setup.metadata."""
+        return self.expe_fn, self.sonic_fn, self.start_datetime, self.end_datetime, \
+            self.date, self.day
+
+
+class PeriodRegistry:
+    """
+    Periods sorted by start with lookup by name, by measuring day and by
+    time overlap. The overlap query uses binary search on the sorted starts
+    (periods are at most as long as the longest one), so only the periods
+    close to the queried range are compared.
+    """
+
+    def __init__(self, periods: list[Period]) -> None:
+        self.periods = sorted(periods, key=lambda p: (p.start, p.end, p.name))
+        self._by_name = {p.name: p for p in self.periods}
+        self._starts = np.array([p.start for p in self.periods], dtype="datetime64[s]")
+        self._ends = np.array([p.end for p in self.periods], dtype="datetime64[s]")
+        self._max_duration = (self._ends - self._starts).max() if self.periods \
+            else np.timedelta64(0, "s")
+
+    def __getitem__(self, name: str) -> Period:
+        try:
+            return self._by_name[name]
+        except KeyError:
+            raise ValueError(f"Invalid period '{name}'.") from None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._by_name
+
+    def __iter__(self):
+        return iter(self.periods)
+
+    def __len__(self) -> int:
+        return len(self.periods)
+
+    def days(self) -> list[Period]:
+        """Return the whole measuring days (Day1, Day2, ...)."""
+        return [p for p in self.periods if p.name == f"Day{p.day}"]
+
+    def by_day(self, day: int | str) -> list[Period]:
+        """Return the PUOs of a measuring day, given as number or date
+        (DD.MM.YYYY)."""
+        return [p for p in self.periods if p.name != f"Day{p.day}"
+                and (p.day == day or p.date == day)]
+
+    def overlapping(self, start_datetime: str, end_datetime: str) -> list[Period]:
+        """Return the periods overlapping the range between start and end
+        datetime (inclusive)."""
+        start, end = np.datetime64(start_datetime, "s"), np.datetime64(end_datetime, "s")
+        lo = np.searchsorted(self._starts, start - self._max_duration, side="left")
+        hi = np.searchsorted(self._starts, end, side="right")
+        return [self.periods[i] for i in range(lo, hi) if self._ends[i] >= start]
+
+
+def discover_raw_files(raw_data_dir: str = RAW_DATA_DIR) -> dict[np.datetime64, dict]:
+    """
+    Return the raw files in the directories raw_data_dir/YYYY_MM_DD/ by
+    date and device as lists of (start of the file in UTC, file name),
+    sorted by start.
+    """
+    raw_files = {}
+    if not os.path.isdir(raw_data_dir):
+        return raw_files
+
+    for day_dir in sorted(os.listdir(raw_data_dir)):
+        if not _DAY_DIR_PATTERN.fullmatch(day_dir):
+            continue
+        date = np.datetime64(day_dir.replace("_", "-"), "D")
+        raw_files[date] = {"EXPE": [], "SONIC": []}
+
+        for fn in sorted(os.listdir(os.path.join(raw_data_dir, day_dir))):
+            for device, pattern in _RAW_FILE_PATTERN.items():
+                match = pattern.fullmatch(fn)
+                if match:
+                    d, t = match["date"].replace("_", ""), match["time"]
+                    start = np.datetime64(f"{d[:4]}-{d[4:6]}-{d[6:]}T{t[:2]}:{t[2:]}", "s") \
+                        - _NAME_CLOCK_OFFSET[device]
+                    raw_files[date][device].append((start, f"{raw_data_dir}/{day_dir}/{fn}"))
+        for device in raw_files[date]:
+            raw_files[date][device].sort()
+    return raw_files
+
+def _raw_file(raw_files: dict, device: str, start: np.datetime64) -> str | None:
+    """Return the last raw file of a device started before start (or the
+    first one of the day)."""
+    files = raw_files.get(start.astype("datetime64[D]"), {}).get(device, [])
+    if not files:
+        return None
+    before = [fn for file_start, fn in files if file_start <= start]
+    return before[-1] if before else files[0][1]
+
+def load_periods(periods_fn: str = PERIODS_FN, raw_data_dir: str = RAW_DATA_DIR) -> PeriodRegistry:
+    """
+    Return the registry of the PUOs in periods_fn (CSV with the columns
+    name, start, end, expe_fn, sonic_fn and note) and the whole measuring
+    days (Day1, Day2, ... from 00:00 to 23:59). Raw files which are not given
+    in periods_fn are looked up in raw_data_dir by date and file name; a day
+    without raw file of a device gets the file given for its PUOs.
+    """
+    raw_files = discover_raw_files(raw_data_dir)
+
+    rows = []
+    if os.path.exists(periods_fn):
+        with open(periods_fn, newline="") as f:
+            rows = list(csv.DictReader(f))
+    for row in rows:
+        row["start"] = np.datetime64(row["start"].replace(" ", "T"), "s")
+        row["end"] = np.datetime64(row["end"].replace(" ", "T"), "s")
+
+    # measuring days: days with raw data or PUOs
+    dates = sorted(set(raw_files) | {row["start"].astype("datetime64[D]") for row in rows})
+    day_numbers = {date: i+1 for i, date in enumerate(dates)}
+
+    # raw files given in periods_fn are also the files of their day (e.g. a
+    # raw file missing in raw_data_dir)
+    given = {}
+    for row in rows:
+        for device in ["EXPE", "SONIC"]:
+            if row.get(f"{device.lower()}_fn"):
+                given.setdefault((row["start"].astype("datetime64[D]"), device),
+                                 row[f"{device.lower()}_fn"])
+
+    periods = []
+    for date in dates:
+        start = date.astype("datetime64[s]")
+        periods.append(Period(
+            name=f"Day{day_numbers[date]}",
+            start=start,
+            end=start + np.timedelta64(23*60 + 59, "m"),
+            day=day_numbers[date],
+            expe_fn=_raw_file(raw_files, "EXPE", start) or given.get((date, "EXPE")),
+            sonic_fn=_raw_file(raw_files, "SONIC", start) or given.get((date, "SONIC"))
+            ))
+    for row in rows:
+        periods.append(Period(
+            name=row["name"],
+            start=row["start"],
+            end=row["end"],
+            day=day_numbers[row["start"].astype("datetime64[D]")],
+            expe_fn=row.get("expe_fn") or _raw_file(raw_files, "EXPE", row["start"]),
+            sonic_fn=row.get("sonic_fn") or _raw_file(raw_files, "SONIC", row["start"]),
+            note=row.get("note", "")
+            ))
+    return PeriodRegistry(periods)
+
+@lru_cache(maxsize=1)
+def periods() -> PeriodRegistry:
+    """Return the registry of the periods (loaded once)."""
+    return load_periods()
+
+def get_period(name: str) -> Period:
+    """Return a period by name."""
+    return periods()[name]
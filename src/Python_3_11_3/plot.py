@@ -1,13 +1,22 @@
+import os
+from typing import Callable
 import pandas as pd
 import numpy as np
-import seaborn as sns
+import matplotlib
+matplotlib.use("Agg")    # figures are only written to files (also in the jobs' processes)
 import matplotlib.pyplot as plt
 from matplotlib.dates import DateFormatter
+from matplotlib.figure import Figure
 
 from parse import get_var
-from process import detrend_signal, taper_signal, calc_spectrum, roll_mean
-from setup import all_puos, variables, metadata, window_functions, unique_dates, \
-    labels, WINDOWS_MIN, SAMPLE_RATE, KERNEL_SIZE, MITTELUNGSINTERVALL
+from results import find_results, read_results, read_results_many
+from instrument import instrumented
+from periods import periods, get_period
+from process import detrend_signal, taper_signal, calc_spectrum, roll_mean, averaging_errors, \
+    log_bin_spectrum
+from setup import all_puos, variables, metadata, \
+    labels, WINDOWS_MIN, SAMPLE_RATE, KERNEL_SIZE, MITTELUNGSINTERVALL, FFT_WORKERS, \
+    SPECTRUM_BINS, TI_INTERVAL_MIN, PLOT_DECIMATION, RENDER_PROFILE, RENDER_PROFILES
 
 
 grid_kwargs =           {"color":"lightgrey", "lw":0.4}
@@ -26,33 +35,225 @@ rename_dict = {
 
 first_n = 300 # reduce spectra to first 300 rows
 
+# -----------------------------------------------------------------------------
+# render profiles and figure templates
+# -----------------------------------------------------------------------------
+
+# the profile is passed to the worker processes of jobs.py by the environment
+_ENV = "RENDER_PROFILE"
+
+_templates = {}     # figures of this process reused by the plots of the same layout
+
+def render_profile() -> dict:
+    """Return the render profile of this run (see RENDER_PROFILES in setup.py)."""
+    return RENDER_PROFILES[os.environ.get(_ENV, RENDER_PROFILE)]
+
+def _apply_render_profile() -> None:
+    antialiased = render_profile()["antialiased"]
+    for key in ["lines.antialiased", "patch.antialiased", "text.antialiased"]:
+        plt.rcParams[key] = antialiased
+
+def set_render_profile(name: str) -> None:
+    """Select the render profile of this process and of the processes
+    started by it."""
+    if name not in RENDER_PROFILES:
+        raise ValueError(f"Invalid render profile '{name}'.")
+    os.environ[_ENV] = name
+    _apply_render_profile()
+    _templates.clear()
+
+_apply_render_profile()
+
+def figure_fn(fn: str) -> str:
+    """Return the file name of a plot (plots/<type>/<name>.png) in the
+    directory and file format of the render profile."""
+    profile = render_profile()
+    root, _ = os.path.splitext(os.path.relpath(fn, "plots"))
+    return os.path.join(profile["dir"], f"{root}.{profile['format']}")
+
+@instrumented("savefig", sizes=False)
+def _savefig(fn: str, fig: Figure | None = None, **kwargs) -> None:
+    """Save a figure (default: the current one) with the render profile
+    (timed by cli.py --instrument)."""
+    profile = render_profile()
+    fn = figure_fn(fn)
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    (fig or plt.gcf()).savefig(fn, dpi=profile["dpi"], format=profile["format"], **kwargs)
+
+def _template(name: str, build: Callable[[], tuple]) -> tuple:
+    """
+    Return the figure and artists of a layout, built on the first call in
+    this process. The plots of many periods and variables with the same
+    layout only update the data and titles of the artists (set_data), which
+    is much faster than building the figure each time. The figures are not
+    managed by pyplot, so plt.close() does not affect them.
+    """
+    if name not in _templates:
+        _templates[name] = build()
+    return _templates[name]
+
+def _rescale(*axes: plt.Axes) -> None:
+    """Rescale the data limits of axes whose artists got new data."""
+    for ax in axes:
+        ax.relim()
+    for ax in axes:
+        ax.autoscale_view()
+
+# -----------------------------------------------------------------------------
+# decimation of dense time series
+# -----------------------------------------------------------------------------
+
+def _as_float(x: np.ndarray) -> np.ndarray:
+    """Return x (numbers or datetimes) as float."""
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.view(np.int64).astype(float)
+    return x.astype(float)
+
+def _first_in_bins(mask: np.ndarray, bins: np.ndarray, default: np.ndarray) -> np.ndarray:
+    """Return the first index where mask is True in each bin (default if none)."""
+    pos = np.flatnonzero(mask)
+    b = bins[pos]
+    first = np.r_[True, b[1:] != b[:-1]]
+    result = default.copy()
+    result[b[first]] = pos[first]
+    return result
+
+def minmax_indices(x: np.ndarray, y: np.ndarray, n_bins: int) -> np.ndarray:
+    """
+    Return the indices of the first, last, minimum and maximum sample of y
+    in n_bins equally wide intervals of x (sorted), M4 decimation. With at
+    least one interval per pixel column, the extremes give the vertical
+    extent of each column and the first and last sample the lines to the
+    neighbouring columns, so all peaks are kept. As the intervals are not
+    aligned to the pixel columns, single pixels at their boundaries can
+    differ from the full series.
+    """
+    n = len(y)
+    xf = _as_float(x)
+    span = xf[-1] - xf[0]
+    if n <= 4*n_bins or span <= 0:
+        return np.arange(n)
+
+    bins = np.minimum(((xf - xf[0]) / span * n_bins).astype(np.int64), n_bins-1)
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    counts = np.diff(np.r_[starts, n])
+    bins = np.repeat(np.arange(len(starts)), counts)
+
+    # NaN are ignored unless all values of an interval are NaN (line break)
+    mins = np.fmin.reduceat(y, starts)
+    maxs = np.fmax.reduceat(y, starts)
+    i_min = _first_in_bins(y == np.repeat(mins, counts), bins, starts)
+    i_max = _first_in_bins(y == np.repeat(maxs, counts), bins, starts)
+    return np.unique(np.r_[starts, starts + counts - 1, i_min, i_max])
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Return the indices of n_out samples chosen by Largest-Triangle-Three-
+    Buckets: the first and last sample and from each of n_out-2 buckets the
+    sample forming the largest triangle with the previously chosen sample
+    and the mean of the next bucket. Keeps the shape of the series, but not
+    necessarily every peak (see minmax_indices).
+    """
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    xf = _as_float(x)
+    yf = np.nan_to_num(np.asarray(y, dtype=float))
+    edges = np.linspace(1, n-1, n_out-1).astype(np.int64)
+
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n-1
+    a = 0
+    for i in range(n_out-2):
+        lo, hi = edges[i], edges[i+1]
+        if i == n_out-3:
+            next_x, next_y = xf[-1], yf[-1]
+        else:
+            next_x, next_y = xf[hi:edges[i+2]].mean(), yf[hi:edges[i+2]].mean()
+        area = np.abs((xf[a] - next_x) * (yf[lo:hi] - yf[a])
+                      - (xf[a] - xf[lo:hi]) * (next_y - yf[a]))
+        a = lo + int(np.argmax(area))
+        idx[i+1] = a
+    return idx
+
+def decimate(
+        x: np.ndarray,
+        y: np.ndarray,
+        n_px: int,
+        method: str | None = PLOT_DECIMATION
+        ) -> tuple[np.ndarray, np.ndarray]:
+    """Return the samples of (x, y) to draw n_px pixel columns wide with
+    method 'minmax' (envelope per pixel column), 'lttb' or None (all)."""
+    if method is None:
+        return x, y
+    if method == "minmax":
+        idx = minmax_indices(x, y, n_px)
+    elif method == "lttb":
+        idx = lttb_indices(x, y, 2*n_px)
+    else:
+        raise ValueError(f"Invalid decimation method '{method}'.")
+    if len(idx) == len(y):
+        return x, y
+    return np.asarray(x)[idx], np.asarray(y)[idx]
+
+def line_data(
+        ax: plt.Axes,
+        x: np.ndarray,
+        y: np.ndarray,
+        xlim: tuple | None = None
+        ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return a time series decimated to what can be displayed in ax: one
+    interval per pixel column of the figure width at the dpi of the render
+    profile (within xlim, if given, where the data outside is dropped).
+    """
+    if xlim is not None:
+        lo, hi = np.searchsorted(x, np.asarray(xlim, dtype=np.asarray(x).dtype))
+        x, y = x[max(lo-1, 0):hi+1], y[max(lo-1, 0):hi+1]
+    n_px = int(np.ceil(ax.figure.get_figwidth() * render_profile()["dpi"]))
+    return decimate(x, y, n_px)
+
+def plot_line(ax: plt.Axes, x: np.ndarray, y: np.ndarray, xlim: tuple | None = None, **kwargs) -> list:
+    """Plot a time series as line, decimated (see line_data)."""
+    return ax.plot(*line_data(ax, x, y, xlim), **kwargs)
+
+def _ts_template(x: np.ndarray) -> tuple[Figure, np.ndarray, list]:
+    """Figure of plot_ts with empty lines (x: time axis of the unit)."""
+    fig = Figure(figsize=(9,6))
+    ax = fig.subplots(nrows=3, ncols=1, sharex=True, gridspec_kw={'hspace': 0.4})
+    
+    ax[0].set_title("A. Originale Zeitreihe", loc="left")
+    ax[1].set_title("B. Zeitreihe nach Trendbereinigung", loc="left")
+    ax[2].set_title("C. Zeitreihe nach Tapering", loc="left")
+    lines = [ax[row_i].plot(x[:0], np.empty(0), **line_kwargs)[0] for row_i in range(3)]
+    
+    ax[2].set_xlabel("Zeit [UTC]")
+    for row_i in range(3):
+        ax[row_i].xaxis.set_major_formatter(DateFormatter('%H:%M'))
+        ax[row_i].grid(True, **grid_kwargs)
+    return fig, ax, lines
+
 def plot_ts(
         x: np.ndarray, y: np.ndarray,
         fn: str, title: str
         ) -> None:
     """Plots the processing steps (raw, detrend, taper) of a time series."""
     
-    fig, ax = plt.subplots(nrows=3, ncols=1, sharex=True, figsize=(9,6), 
-                           gridspec_kw={'hspace': 0.4})
+    fig, ax, lines = _template("ts", lambda: _ts_template(x))
     
     # plot data
-    ax[0].set_title("A. Originale Zeitreihe", loc="left")
-    ax[0].plot(x, y, **line_kwargs)
-    ax[1].set_title("B. Zeitreihe nach Trendbereinigung", loc="left")
-    ax[1].plot(x, detrend_signal(y), **line_kwargs)
-    ax[2].set_title("C. Zeitreihe nach Tapering", loc="left")
-    ax[2].plot(x, taper_signal(detrend_signal(y), 0.1), **line_kwargs)
+    y_det = detrend_signal(y)
+    for row_i, y_step in enumerate([y, y_det, taper_signal(y_det, 0.1)]):
+        lines[row_i].set_data(*line_data(ax[row_i], x, y_step))
+    _rescale(*ax)
     
     # plot config
     fig.suptitle(title, **title_kwargs)
-    ax[2].set_xlabel("Zeit [UTC]")
-    for row_i in range(3):
-        ax[row_i].xaxis.set_major_formatter(DateFormatter('%H:%M'))
-        ax[row_i].set_xlim(x[0], x[-1])
-        ax[row_i].grid(True, **grid_kwargs)
+    ax[0].set_xlim(x[0], x[-1])
     
-    plt.savefig(f"plots/preprocessing/preprocess_{fn}.png", dpi=600, bbox_inches="tight")
-    plt.close()
+    _savefig(f"plots/preprocessing/preprocess_{fn}.png", fig=fig, bbox_inches="tight")
     
 def plot_spectrum(
         x: np.ndarray, y: np.ndarray,
@@ -67,7 +268,7 @@ def plot_spectrum(
                            gridspec_kw={'hspace': 0.4})
     fig.suptitle(title, **title_kwargs)
     
-    ax[0].plot(x, y_tapered, label="Zeitreihe nach Tapering", **line_kwargs)
+    plot_line(ax[0], x, y_tapered, label="Zeitreihe nach Tapering", **line_kwargs)
     ax[1].scatter(freq, spec, label="Spektrum", **scat_kw_args)
     ax[1].plot(freq, roll_mean(spec, win_len=10), label=f"Gleitendes Mittel (Fensterbreite={KERNEL_SIZE})", **smooth_spec_kw_args)
     ax[1].axvspan(1/(60*30), 1/(60*60), label="30 min - 60 min", **range_kw_args)
@@ -89,9 +290,29 @@ def plot_spectrum(
         ax[i].grid(True)
         ax[i].legend(loc="upper left", fontsize=12)
         
-    plt.savefig(f"plots/spectra/spec_{fn}.png", dpi=600, bbox_inches="tight")
+    _savefig(f"plots/spectra/spec_{fn}.png", bbox_inches="tight")
     plt.close()
     
+def binned_spectrum(puo: str, device: str, columns: list[str]) -> pd.DataFrame:
+    """Return columns of the binned spectrum of a PUO. If it was not saved
+    (e.g. PUOs without raw files, whose results were saved before the
+    binning), the spectrum with all FFT bins is binned like in
+    main_calculation.binned_data."""
+    name = f"{puo}_{device}_binned_spectrum_data"
+    if os.path.exists(find_results("spectra_data", name)):
+        return read_results("spectra_data", name, columns=columns)
+
+    spectrum = read_results("spectra_data", f"{puo}_{device}_spectrum_data",
+                            columns=["frequencies"] + [f"{var}_spec" for var in variables[device]])
+    binned_data = {}
+    for var in variables[device]:
+        binned = log_bin_spectrum(spectrum["frequencies"].to_numpy(),
+                                  spectrum[f"{var}_spec"].to_numpy(), n_bins=SPECTRUM_BINS)
+        binned_data["frequencies"] = binned["frequencies"]
+        binned_data[f"{var}_mean"] = binned["mean"]
+        binned_data[f"{var}_var"] = binned["var"]
+    return pd.DataFrame(binned_data)[columns]
+
 def plot_spectrum_comp(device: str) -> None:
     """Plots a comparison of all smoothed spectra."""
     
@@ -102,18 +323,20 @@ def plot_spectrum_comp(device: str) -> None:
         }
     
     for var in variables[device]:
-        var = var+"_spec"
         fig, ax = plt.subplots(3, 4, figsize=(19, 11), sharex=False, sharey=False)
-        fig.suptitle(labels[var]+f"\n\n({device}, {SAMPLE_RATE[device]} Hz)", **title_kwargs)
+        fig.suptitle(labels[var+"_spec"]+f"\n\n({device}, {SAMPLE_RATE[device]} Hz)", **title_kwargs)
     
         for i, puo in enumerate(all_puos):
-            df = pd.read_csv(f"data/spectra_data/{puo}_{device}_spectrum_data.csv")
+            df = binned_spectrum(puo, device,
+                                 columns=["frequencies", f"{var}_mean", f"{var}_var"])
+            std = np.sqrt(df[f"{var}_var"])
             
-            # plot data            
-            lns1 = ax[i // 4, i % 4].scatter(df["frequencies"], df[var], s=0.5, alpha=0.5, 
-                                     color="grey", label="Spektrum")
-            lns2 = ax[i // 4, i % 4].plot(df["frequencies"], roll_mean(df[var], win_len=10), 
-                                  lw=0.5, c="r", label=f"Gleitendes Mittel (Fensterbreite={KERNEL_SIZE})")
+            # plot data (spectrum averaged in log-spaced frequency bins)
+            lns1 = ax[i // 4, i % 4].fill_between(df["frequencies"], df[f"{var}_mean"]-std, 
+                                     df[f"{var}_mean"]+std, color="grey", alpha=0.3, 
+                                     lw=0, label="Standardabweichung im Bin")
+            lns2 = ax[i // 4, i % 4].plot(df["frequencies"], df[f"{var}_mean"], 
+                                  lw=0.5, c="r", label=f"Mittel in {SPECTRUM_BINS} log. Frequenzbins")
             lns3 = ax[i // 4, i % 4].axvspan(1/(60*30), 1/(60*60), label="30 min - 60 min", 
                                      **range_kw_args)
             
@@ -133,7 +356,7 @@ def plot_spectrum_comp(device: str) -> None:
             
         fig.text(-0.02, 0.5, "Spektrale Energiedichte * Frequenz", va='center', rotation='vertical', fontsize=12)
         plt.tight_layout()
-        plt.savefig(f"plots/spectra_comparison/spectra_temporal_comparison_{device}_{var}.png", dpi=600, bbox_inches="tight")
+        _savefig(f"plots/spectra_comparison/spectra_temporal_comparison_{device}_{var}_spec.png", bbox_inches="tight")
         plt.close()
 
 def plot_spectrum_comp_all() -> None:
@@ -147,22 +370,22 @@ def plot_spectrum_comp_all() -> None:
                                     **range_kw_args)
         
         # EXPE temp
-        df = pd.read_csv(f"data/spectra_data/{puo}_EXPE_spectrum_data.csv")
-        ln1 = ax[i // 4, i % 4].plot(df["frequencies"], roll_mean(df["t_spec"], win_len=10), 
+        df = binned_spectrum(puo, "EXPE",
+                             columns=["frequencies", "t_mean"])
+        ln1 = ax[i // 4, i % 4].plot(df["frequencies"], df["t_mean"], 
                         lw=0.5, c="darkorange", ls="-", label="Temperatur in °C (EXPE, 1 Hz)")
         # SONIC temp
-        df = pd.read_csv(f"data/spectra_data/{puo}_SONIC_spectrum_data.csv")
-        ln2 = ax[i // 4, i % 4].plot(df["frequencies"], roll_mean(df["t_spec"], win_len=10), 
+        df = binned_spectrum(puo, "SONIC",
+                             columns=["frequencies", "t_mean", "wind_h_mean", "wind_z_mean"])
+        ln2 = ax[i // 4, i % 4].plot(df["frequencies"], df["t_mean"], 
                         lw=0.5, c="r", ls="-", label="Temperatur in °C (SONIC, 2 Hz)")
             
         # horizontal wind
-        df = pd.read_csv(f"data/spectra_data/{puo}_SONIC_spectrum_data.csv")
-        ln1 = ax[i // 4, i % 4].plot(df["frequencies"], roll_mean(df["wind_h_spec"], win_len=10), 
+        ln1 = ax[i // 4, i % 4].plot(df["frequencies"], df["wind_h_mean"], 
                         lw=0.5, c="b", label="Horizontalwind in m/s (2 Hz)")
         
         # vertical wind
-        df = pd.read_csv(f"data/spectra_data/{puo}_SONIC_spectrum_data.csv")
-        ln2 = ax[i // 4, i % 4].plot(df["frequencies"], roll_mean(df["wind_z_spec"], win_len=10), 
+        ln2 = ax[i // 4, i % 4].plot(df["frequencies"], df["wind_z_mean"], 
                         lw=0.5, c="g", label="Vertikalwind in m/s (2 Hz)")
         
         _, _, start_datetime, end_datetime, date, _ = metadata(puo)
@@ -192,7 +415,7 @@ def plot_spectrum_comp_all() -> None:
         line.set_linewidth(4.0)
             
     plt.tight_layout()
-    plt.savefig(f"plots/spectra_comparison/spectra_temporal_comparison.png", dpi=600, bbox_inches="tight")
+    _savefig(f"plots/spectra_comparison/spectra_temporal_comparison.png", bbox_inches="tight")
     plt.close()
 
 def plot_wind_spectrum_comp() -> None:
@@ -205,14 +428,15 @@ def plot_wind_spectrum_comp() -> None:
         ax[i // 4, i % 4].axvspan(1/(60*30), 1/(60*60), label="30 min - 60 min", 
                                     **range_kw_args)
         
+        df = binned_spectrum(puo, "SONIC",
+                             columns=["frequencies", "wind_h_mean", "wind_z_mean"])
+        
         # horizontal wind
-        df = pd.read_csv(f"data/spectra_data/{puo}_SONIC_spectrum_data.csv")
-        ln1 = ax[i // 4, i % 4].plot(df["frequencies"], roll_mean(df["wind_h_spec"], win_len=10), 
+        ln1 = ax[i // 4, i % 4].plot(df["frequencies"], df["wind_h_mean"], 
                         lw=0.5, c="b", label="Horizontalwind in m/s (2 Hz)")
         
         # vertical wind
-        df = pd.read_csv(f"data/spectra_data/{puo}_SONIC_spectrum_data.csv")
-        ln2 = ax[i // 4, i % 4].plot(df["frequencies"], roll_mean(df["wind_z_spec"], win_len=10), 
+        ln2 = ax[i // 4, i % 4].plot(df["frequencies"], df["wind_z_mean"], 
                         lw=0.5, c="g", label="Vertikalwind in m/s (2 Hz)")
             
         _, _, start_datetime, end_datetime, date, _ = metadata(puo)
@@ -238,13 +462,34 @@ def plot_wind_spectrum_comp() -> None:
         line.set_linewidth(4.0)
             
     plt.tight_layout()
-    plt.savefig(f"plots/spectra_comparison/spectra_temporal_comparison_SONIC_wind.png", dpi=600, bbox_inches="tight")
+    _savefig(f"plots/spectra_comparison/spectra_temporal_comparison_SONIC_wind.png", bbox_inches="tight")
     plt.close()
 
 
 
-def plot_avg(x: np.ndarray, y: np.ndarray, device: str, title: str, fn: str) -> dict:
-    """Plots the average of a time series."""
+def averaging_data(y: np.ndarray, device: str) -> dict:
+    """
+    Calculate the averaging of a time series without plotting it: the
+    detrended signal, its rolling means for WINDOWS_MIN and their deviation
+    from the MITTELUNGSINTERVALL mean (see process.averaging_errors) and
+    the error metrics per window rounded to 2 decimals ("metrics").
+    """
+    y_det = detrend_signal(y)
+    errors = averaging_errors(y_det, [i*60*SAMPLE_RATE[device] for i in WINDOWS_MIN],
+                              MITTELUNGSINTERVALL*60*SAMPLE_RATE[device])
+    metrics = {metric: np.round(errors[metric], 2).tolist()
+               for metric in ["Mean", "Std", "Lower Range", "Upper Range"]}
+    return {"det": y_det, **errors, "metrics": metrics}
+
+def plot_avg(
+        x: np.ndarray, y: np.ndarray, device: str, title: str, fn: str,
+        data: dict | None = None
+        ) -> dict:
+    """Plots the average of a time series and returns the error metrics.
+    The averaging is calculated with averaging_data, unless given as data."""
+    if data is None:
+        data = averaging_data(y, device)
+    error_metrics = data["metrics"]
 
     fig, ax = plt.subplots(nrows=3, ncols=1, figsize=(10,7))
     fig.suptitle(title, **title_kwargs)
@@ -254,33 +499,15 @@ def plot_avg(x: np.ndarray, y: np.ndarray, device: str, title: str, fn: str) ->
     
     # plot detrended signal
     ax[0].set_title("A. Trendbereinigtes Signal", loc="left")
-    y_det = detrend_signal(y)
-    ax[0].plot(x, y_det, color="grey", lw=lw[device])
+    plot_line(ax[0], x, data["det"], color="grey", lw=lw[device])
     ax[0].xaxis.set_major_formatter(DateFormatter('%H:%M'))
     
-    
-    win_lens = [i*60*SAMPLE_RATE[device] for i in WINDOWS_MIN]
-    ref = roll_mean(y_det, win_len=MITTELUNGSINTERVALL*60*SAMPLE_RATE[device])
-    
-    diff_lists = []
-    error_metrics = {"Mean": [], "Std": [], "Lower Range": [], "Upper Range": []}
-    
-    for i, win_len in enumerate(win_lens):
-        
-        # plot rolling mean
-        ax[1].set_title("B. Gleitendes Mittel verschiedener Fensterbreiten", loc="left")    
-        y_roll = roll_mean(y_det, win_len)
-        ax[1].plot(x, y_roll, color=colors[i], lw=lw[device], 
-                   label=f"{WINDOWS_MIN[i]} min")
-        ax[1].xaxis.set_major_formatter(DateFormatter('%H:%M'))
-        
-        # calculate error metrics
-        diff = [i-j for i, j in zip(y_roll, ref)]
-        diff_lists.append(diff)
-        error_metrics["Std"].append(np.round(np.sum([x**2 for x in diff])/(len(ref)-1), 2))
-        error_metrics["Lower Range"].append(np.round(np.min(diff), 2))
-        error_metrics["Upper Range"].append(np.round(np.max(diff), 2))
-        error_metrics["Mean"].append(np.round(np.mean(diff), 2))
+    # plot rolling means
+    ax[1].set_title("B. Gleitendes Mittel verschiedener Fensterbreiten", loc="left")    
+    for i, y_roll in enumerate(data["means"]):
+        plot_line(ax[1], x, y_roll, color=colors[i], lw=lw[device], 
+                  label=f"{WINDOWS_MIN[i]} min")
+    ax[1].xaxis.set_major_formatter(DateFormatter('%H:%M'))
 
     # plot deviation from reference    
     # sns.violinplot(data=diff_lists, ax=ax[2], palette=colors, 
@@ -289,8 +516,8 @@ def plot_avg(x: np.ndarray, y: np.ndarray, device: str, title: str, fn: str) ->
     #                )
     
     # create a boxplot instead of violinplot with each box have a single color from colors
-    for i, diff_list in enumerate(diff_lists):
-        ax[2].boxplot(diff_list, positions=[i], widths=0.25, notch=True, showfliers=False,
+    for i, diff in enumerate(data["diff"]):
+        ax[2].boxplot(diff, positions=[i], widths=0.25, notch=True, showfliers=False,
                       patch_artist=True, 
                       boxprops=dict(facecolor=colors[i], color="k", alpha=0.6),
                       medianprops=dict(color="k"),
@@ -309,12 +536,13 @@ def plot_avg(x: np.ndarray, y: np.ndarray, device: str, title: str, fn: str) ->
         ax[row_i].grid(True)
     
     plt.tight_layout()
-    plt.savefig(f"plots/averaging/{fn}_{MITTELUNGSINTERVALL}min.png", dpi=600, bbox_inches="tight")
+    _savefig(f"plots/averaging/{fn}_{MITTELUNGSINTERVALL}min.png", bbox_inches="tight")
     plt.close()
     return error_metrics
 
 def plot_win() -> None:
     """Plots the nonparametric window functions."""
+    from setup import window_functions
     
     _, ax = plt.subplots(nrows=4, ncols=4, figsize=(10, 10),
                            sharex=True, sharey=True)
@@ -337,31 +565,46 @@ def plot_win() -> None:
         ax[i//4, i%4].grid(which="both", axis="both", alpha=0.2)
 
     ax[0, 0].legend(loc='center')
-    plt.savefig("plots/sensitivity_wf/window_functions.png", dpi=600, bbox_inches="tight")
+    _savefig("plots/sensitivity_wf/window_functions.png", bbox_inches="tight")
     plt.close()
 
-def plot_win_influence(x: np.ndarray, y: np.ndarray, title: str, fn: str) -> None:
-    """Plots the influence of different window functions on the spectrum."""
+def _win_influence_template() -> tuple[Figure, np.ndarray, list]:
+    """Figure of plot_win_influence with an empty line per window function."""
+    from setup import window_functions
     
-    fig, ax = plt.subplots(nrows=4, ncols=4, figsize=(10, 10),
-                           sharex=True, sharey=True)
-    
-    fig.suptitle(title, **title_kwargs)
+    fig = Figure(figsize=(10, 10))
+    ax = fig.subplots(nrows=4, ncols=4, sharex=True, sharey=True)
     
+    lines = []
     for i, wf in enumerate(window_functions):
-        freq, spec = calc_spectrum(x, taper_signal(detrend_signal(y), 0.1, func=wf))
-        spec_roll = roll_mean(spec, win_len=10)
-        
-        ax[i//4, i%4].plot(freq, spec_roll, 
-                           label=wf.__name__, c="navy", lw=0.4)
+        lines += ax[i//4, i%4].plot([], [], label=wf.__name__, c="navy", lw=0.4)
         ax[i//4, i%4].set_xscale("log")
         ax[i//4, i%4].set_xlim((1e-4, 1e-1))
         ax[i//4, i%4].set_xticks([1e-4, 1e-3, 1e-2, 1e-1])
         ax[i//4, i%4].set_title(wf.__name__)
         ax[i//4, i%4].grid(which="both", axis="both", alpha=0.2)
+    return fig, ax, lines
 
-    plt.savefig(f"plots/sensitivity_wf/{fn}.png", dpi=600, bbox_inches="tight")
-    plt.close()
+def plot_win_influence(x: np.ndarray, y: np.ndarray, title: str, fn: str) -> None:
+    """Plots the influence of different window functions on the spectrum."""
+    from setup import window_functions
+    
+    fig, ax, lines = _template("win_influence", _win_influence_template)
+    
+    fig.suptitle(title, **title_kwargs)
+    
+    # spectra of the signal tapered with each window function in one FFT call
+    y_det = detrend_signal(y)
+    y_tap = np.empty((len(window_functions), len(y_det)))
+    for i, wf in enumerate(window_functions):
+        taper_signal(y_det, 0.1, func=wf, out=y_tap[i])
+    freq, spectra = calc_spectrum(x, y_tap, workers=FFT_WORKERS)
+    
+    for i, line in enumerate(lines):
+        line.set_data(freq, roll_mean(spectra[i], win_len=10))
+    _rescale(*ax.flat)
+
+    _savefig(f"plots/sensitivity_wf/{fn}.png", fig=fig, bbox_inches="tight")
 
 def plot_temporal_coverage() -> None:
     """Plots the temporal coverage of the experiments."""
@@ -370,12 +613,12 @@ def plot_temporal_coverage() -> None:
                          sharex=False, sharey=True, 
                          gridspec_kw = {'wspace':0, 'hspace':1})
     
-    for i in range(len(unique_dates)):
+    for i, day in enumerate(periods().days()):
         row_i = i // 3
         col_i = i % 3
         
         # get data
-        period = f"Day{i+1}"
+        period = day.name
         expe_dt = get_var("EXPE", period, "Datetime")
         expe_t = get_var("EXPE", period, "t")
         sonic_dt = get_var("SONIC", period, "Datetime")
@@ -383,35 +626,30 @@ def plot_temporal_coverage() -> None:
         sonic_h = get_var("SONIC", period, "wind_h")
                 
         ax2 = ax[row_i, col_i].twinx()
+        xlim = (day.start + np.timedelta64(5, "h"), day.start + np.timedelta64(17, "h"))
         
-        # plot data
-        lns1 = ax[row_i, col_i].plot(
-            sonic_dt, sonic_t, label="SONIC Temperatur", 
+        # plot data (only the displayed hours)
+        lns1 = plot_line(ax[row_i, col_i], 
+            sonic_dt, sonic_t, xlim=xlim, label="SONIC Temperatur", 
             lw=0.3, ls = "solid", alpha=0.6, c="darkblue")
-        lns2 = ax[row_i, col_i].plot(
-            expe_dt, expe_t, label="EXPE Temperatur", 
+        lns2 = plot_line(ax[row_i, col_i], 
+            expe_dt, expe_t, xlim=xlim, label="EXPE Temperatur", 
             lw=0.5, ls="solid", alpha=0.6, c="blue")
-        lns3 = ax2.plot(
-            sonic_dt, sonic_h, label="SONIC Horizontalwind",
+        lns3 = plot_line(ax2, 
+            sonic_dt, sonic_h, xlim=xlim, label="SONIC Horizontalwind",
             lw=0.3, alpha=0.6, c="r", )
     
         # highlight puos
-        ranges = []
-        for puo in all_puos:
-            _, _, start_date, end_date, _, day = metadata(puo)
-            start = pd.to_datetime(start_date, format="%Y-%m-%d %H:%M:%S")
-            end = pd.to_datetime(end_date, format="%Y-%m-%d %H:%M:%S")
-            ranges.append((day-1, start, end))
-            
-        for j in range(len(ranges)): 
-            ax_i, start, end = ranges[j]
-            if ax_i == i:
+        for j, puo in enumerate(all_puos):
+            p = get_period(puo)
+            if p.day == day.day:
+                start, end = pd.Timestamp(p.start), pd.Timestamp(p.end)
                 hours = round((end-start).total_seconds()/(60*60), 1)
-                ax[row_i, col_i].axvspan(ranges[j][1], ranges[j][2], alpha=0.1, 
+                ax[row_i, col_i].axvspan(start, end, alpha=0.1, 
                                          color='gold', label=f"PUO {j+1}: {hours} h")
         
         # plot config
-        ax[row_i, col_i].set_title(f"Messtag {i+1}: {unique_dates[i]}", loc="left", **title_kwargs)
+        ax[row_i, col_i].set_title(f"Messtag {day.day}: {day.date}", loc="left", **title_kwargs)
         ax[row_i, 0].set_ylabel("Temperatur [°C]", color="darkblue")
         ax[row_i, col_i].set_xlabel("Zeit [UTC]")
         ax[row_i, col_i].set_ylim((10,45))
@@ -426,12 +664,7 @@ def plot_temporal_coverage() -> None:
         if col_i != 2:
             ax2.set_yticks([])
         
-        date = unique_dates[i]
-        da, mo, ye = date.split(".")
-        ax[row_i, col_i].set_xlim((
-                pd.Timestamp(int(ye), int(mo), int(da), 5, 0), 
-                pd.Timestamp(int(ye), int(mo), int(da), 17, 0)
-                ))
+        ax[row_i, col_i].set_xlim((pd.Timestamp(xlim[0]), pd.Timestamp(xlim[1])))
         
         lns = lns1+lns2+lns3
         labs = [l.get_label() for l in lns]
@@ -442,18 +675,18 @@ def plot_temporal_coverage() -> None:
         ax[1, 2].axis('off')
         
     plt.tight_layout()
-    plt.savefig("plots/temporal_coverage/temporal_coverage.png", 
-                dpi=600, bbox_inches='tight')
+    _savefig("plots/temporal_coverage/temporal_coverage.png", bbox_inches='tight')
     plt.close()
 
 
 def plot_patterns(period: str) -> None:
     """Plot all spectra for a single period under observation."""
+    import seaborn as sns
     
     _, ax = plt.subplots(1, 1, figsize=(8, 5))
     
     # read spectra data
-    df = pd.read_csv(f"data/spectra_data/{period}_comparison_spectrum_data.csv")
+    df = read_results("spectra_data", f"{period}_comparison_spectrum_data")
     
     # norm spectra
     df = (df-df.min())/(df.max()-df.min())
@@ -501,7 +734,7 @@ def plot_patterns(period: str) -> None:
     ax2 = ax.secondary_xaxis(-0.15, functions=(lambda x: 1/x, lambda x: 1/x))
     ax2.set_xticks([10000, 1000, 100, 10])
     ax2.set_xlabel("Periodendauer [s]")
-    plt.savefig(f"plots/spectra_comparison/spectra_variable_comparison_{period}.png", bbox_inches="tight", dpi=600)
+    _savefig(f"plots/spectra_comparison/spectra_variable_comparison_{period}.png", bbox_inches="tight")
     plt.close()
     
     
@@ -509,7 +742,7 @@ def plot_patterns(period: str) -> None:
     _, ax = plt.subplots(1, 1, figsize=(7.5, 6))
     
     # read spectra data
-    df = pd.read_csv(f"data/spectra_data/{period}_comparison_spectrum_data.csv")
+    df = read_results("spectra_data", f"{period}_comparison_spectrum_data")
     
     # norm spectra
     df = (df-df.min())/(df.max()-df.min())
@@ -537,17 +770,18 @@ def plot_patterns(period: str) -> None:
                 linewidths=.5,
                 cmap="vlag", vmin=-1, vmax=1,
                 )
-    plt.savefig(f"plots/spectra_comparison/spectra_variable_comparison_corr_{period}.png", bbox_inches="tight", dpi=600)
+    _savefig(f"plots/spectra_comparison/spectra_variable_comparison_corr_{period}.png", bbox_inches="tight")
     plt.close()
 
     
 def plot_mean_corr():
     """Plots the mean correlation matrix of all periods under observation."""
+    import seaborn as sns
     
     # calculate mean correlation
     corr_dfs = []
     for period in all_puos:
-        df = pd.read_csv(f"data/spectra_data/{period}_comparison_spectrum_data.csv")
+        df = read_results("spectra_data", f"{period}_comparison_spectrum_data")
         
         # reduce spectra to first 300 rows
         
@@ -575,10 +809,18 @@ def plot_mean_corr():
                 cmap="vlag", vmin=-1, vmax=1
                 )
     
-    plt.savefig(f"plots/other/correlation_mean.png", bbox_inches="tight", dpi=600)
+    _savefig(f"plots/other/correlation_mean.png", bbox_inches="tight")
     plt.close()
 
+def ti_slots(dt: np.ndarray, interval_min: int = TI_INTERVAL_MIN) -> np.ndarray:
+    """Return the index of the averaging interval of the day (0 from 00:00)
+    of timestamps."""
+    minutes = (dt - dt.astype("datetime64[D]")) // np.timedelta64(1, "m")
+    return minutes // interval_min
+
 def plot_turb_intensity(which: str) -> None:
+    """Plots the turbulence intensity ('abs' or 'rel') of all periods by
+    time of day, one scatter per device and variable."""
 
     plt.figure(figsize=(7, 4))
     
@@ -589,68 +831,56 @@ def plot_turb_intensity(which: str) -> None:
         "SONIC_wind_z": "g"
         }
     
-    for period in all_puos:
-        _, _, start_datetime, end_datetime, date, _ = metadata(period)
-        if period != "PUO_05":
-            for device in ["EXPE", "SONIC"]:
-                df = pd.read_csv(f"data/turbulence_intensity_data/{period}_{device}_turbulence_intensity_data.csv")
-                df["time"] = df["from"].apply(lambda x: x[11:16])
-                
-                for var in variables[device]:
-                    x = [f"{str(i).zfill(2)}:{str(j).zfill(2)}" for i in range(24) for j in range(0, 60, 10)]
-                    y = [np.nan for _ in range(len(x))]
-
-                    for i in range(len(df)):
-                        if which == "abs":
-                            y[x.index(df["time"][i])] = df[f"{var}_abs"][i]
-                        elif which == "rel":
-                            y[x.index(df["time"][i])] = df[f"{var}_rel"][i]
-                    
-                        plt.scatter(x, y, label=f"{device}: {labels[var]}", 
-                                lw=0.5, color=colors[f"{device}_{var}"], 
-                                alpha=0.5, s=10, zorder=10
-                                )
+    puos = [period for period in all_puos if period != "PUO_05"]
+    for device in ["EXPE", "SONIC"]:
+        df = read_results_many("turbulence_intensity_data",
+                               [f"{period}_{device}_turbulence_intensity_data" for period in puos],
+                               columns=["from"] + [f"{var}_{which}" for var in variables[device]])
+        x = ti_slots(pd.to_datetime(df["from"]).to_numpy())
+        
+        for var in variables[device]:
+            plt.scatter(x, df[f"{var}_{which}"], label=f"{device}: {labels[var]}", 
+                        lw=0.5, color=colors[f"{device}_{var}"], 
+                        alpha=0.5, s=10, zorder=10
+                        )
     
     plt.ylabel("Turbulenzintensität")
     plt.xlabel("Zeit [UTC]")
     plt.grid()
-    plt.xticks([f"{str(i).zfill(2)}:00" for i in range(6,18,1)], rotation=90)
+    hours = np.arange(6, 18)
+    plt.xticks(hours*60 // TI_INTERVAL_MIN, [f"{h:02d}:00" for h in hours], rotation=90)
     if which == "abs":
         pass
     else:
         plt.ylim([0,3.5])
     
-    leg_handles, leg_labels = plt.gca().get_legend_handles_labels()
-    by_label = dict(zip(leg_labels, leg_handles))
-    plt.legend(by_label.values(), by_label.keys(), loc="lower center", ncol=2,
-               bbox_to_anchor=(0.5, 1.0), fontsize=8)
+    plt.legend(loc="lower center", ncol=2, bbox_to_anchor=(0.5, 1.0), fontsize=8)
     
-    plt.savefig(f"plots/turbulent_intensity/turbulent_intensity_{which}_without_PUO05.png", dpi=600, bbox_inches="tight")
+    _savefig(f"plots/turbulent_intensity/turbulent_intensity_{which}_without_PUO05.png", bbox_inches="tight")
     plt.close()
     
-def plot_error_metrics(fn: str = "data/avg_error_metrics.csv") -> None:
+def plot_error_metrics(kind: str = "error_metrics", name: str = "avg_error_metrics") -> None:
+    """Plots the error metrics of the averaging of all PUOs (see
+    main_plotting.save_error_metrics)."""
     from setup import labels, all_puos
 
-    # Read data
-    df = pd.read_csv(fn)
+    # Read data (long form: PUO, Device, Variable, Window, Metric, Value)
+    df = read_results(kind, name)
     df = df[df["Variable"] != "wind_z"]
     df = df[df["Variable"] != "wind_h"]
 
+    # one row of values by window per device, PUO and metric
+    table = df.pivot(index=["Device", "PUO", "Metric"], columns="Window", values="Value")
+
     # remove first puo from all_puos because it is an outlier
     all_puos = all_puos[1:]
 
     # Plot
     _, ax = plt.subplots(nrows=2, ncols=3, figsize=(11, 8), sharey=True)
 
-    def get_data(df, device: str, puo: str, metric: str) -> list[float]:
+    def get_data(device: str, puo: str, metric: str) -> np.ndarray:
         """Helper function to provide data for plotting."""
-        df_sub = df.copy()
-        df_sub = df[df["Device"] == device]
-        df_sub = df_sub[df_sub["PUO"] == puo]
-        arr = df_sub[metric].to_numpy()[0]
-        arr = arr[1:-1].split(", ")
-        arr = [float(val) for val in arr]
-        return arr
+        return table.loc[(device, puo, metric), WINDOWS_MIN].to_numpy()
 
     offsets = np.linspace(-0.25, 0.25, 10)
     colors = ["b", "cyan", "gold", "orange", "r"]
@@ -672,7 +902,7 @@ def plot_error_metrics(fn: str = "data/avg_error_metrics.csv") -> None:
             # EXPE
             barlist = ax[0, col_i].barh(
                 y=[j + off for j in range(5)], 
-                width=get_data(df, device="EXPE", puo=puo, metric=plotting_agenda[row_i, col_i]), 
+                width=get_data(device="EXPE", puo=puo, metric=plotting_agenda[row_i, col_i]), 
                 height=0.02, label=puo, zorder=2, alpha=0.8)
             for i in range(5):
                 barlist[i].set_color(colors[i])
@@ -680,7 +910,7 @@ def plot_error_metrics(fn: str = "data/avg_error_metrics.csv") -> None:
             # SONIC
             barlist = ax[1, col_i].barh(
                 y=[j + off for j in range(5)], 
-                width=get_data(df, device="SONIC", puo=puo, metric=plotting_agenda[row_i, col_i]), 
+                width=get_data(device="SONIC", puo=puo, metric=plotting_agenda[row_i, col_i]), 
                 height=0.02, label=puo, zorder=2, alpha=0.8)
             for i in range(5):
                 barlist[i].set_color(colors[i])
@@ -703,5 +933,5 @@ def plot_error_metrics(fn: str = "data/avg_error_metrics.csv") -> None:
 
         
     plt.subplots_adjust(wspace=0.05, hspace=0.4)
-    plt.savefig(f"plots/other/error_metrics_{MITTELUNGSINTERVALL}min.png", dpi=600, bbox_inches="tight")
+    _savefig(f"plots/other/error_metrics_{MITTELUNGSINTERVALL}min.png", bbox_inches="tight")
     plt.close()
\ No newline at end of file
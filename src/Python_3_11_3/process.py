@@ -1,5 +1,12 @@
-import scipy 
 import numpy as np
+from fractions import Fraction
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator, Sequence
+
+from instrument import instrumented
+
+# scipy is imported in the functions (scipy.signal alone takes about half a
+# second), so runs answered from the caches do not load it
 
 
 def sample_size(x: np.ndarray) -> int:
@@ -16,47 +23,80 @@ def sample_freq(x: np.ndarray) -> np.ndarray:
     """Return sample frequencies."""
     n = sample_size(x)
     sr = sample_rate(x)
-    freq = scipy.fft.fftfreq(n, 1/sr)[1:n//2]
+    from scipy.fft import rfftfreq
+    freq = rfftfreq(n, 1/sr)[1:n//2]
     return freq
 
+@instrumented()
 def detrend_signal(y: np.ndarray) -> np.ndarray:
     """Detrend the signal."""
-    y_det = scipy.signal.detrend(y, type="linear")
+    from scipy.signal import detrend
+    y_det = detrend(y, type="linear")
     return y_det
 
+@instrumented()
 def taper_signal(
         y: np.ndarray,
         perc: float, 
-        func: scipy.signal.windows = scipy.signal.windows.cosine
+        func: Callable[..., np.ndarray] | None = None,
+        out: np.ndarray | None = None
         ) -> np.ndarray:
     """Taper the signal.
 
     Args:
-        y (np.ndarray): data
-        func (scipy.signal.windows): window function
+        y (np.ndarray): data (several signals of equal length as rows possible)
+        func (Callable): window function of scipy.signal.windows
+            (default: cosine)
         perc (float): percentage of first and last values to tapered.
             Must be between 0 (no tapering) and 0.5 (full range).
+        out (np.ndarray): optional buffer of the shape of y for the result,
+            may be y itself to taper in place
 
     Returns:
         np.ndarray: tapered data
     """
     
-    n = len(y)
-    t_width = int(perc * len(y))
+    if func is None:
+        from scipy.signal.windows import cosine as func
+    scaling = _taper_scaling(func, y.shape[-1], perc)
+    return np.multiply(scaling, y, out=out)
+
+@lru_cache(maxsize=64)
+def _taper_scaling(
+        func: Callable[..., np.ndarray],
+        n: int,
+        perc: float
+        ) -> np.ndarray:
+    """Return the (read-only) scaling vector of taper_signal. It is cached,
+    because the same tapering is applied to many signals of the same length."""
+    
+    t_width = int(perc * n)
     
     if perc == 0.5:
-        y_tap = func(M=len(y)) * y
+        scaling = func(M=n)
     else:
         wf = func(M=2*t_width)
         scaling = np.ones(n)
         scaling[:t_width] = wf[:t_width]
         scaling[n-t_width:] = wf[t_width:]
-        y_tap = scaling * y
-    return y_tap
+    scaling.setflags(write=False)
+    return scaling
 
-def calc_spectrum(x: np.ndarray, y: np.ndarray
+@instrumented()
+def calc_spectrum(x: np.ndarray, y: np.ndarray, workers: int | None = None
                   ) -> tuple[np.ndarray, np.ndarray]:
-    """Return the sample frequencies and spectrum of the signal."""
+    """Return the sample frequencies and spectrum of the signal.
+
+    Args:
+        x (np.ndarray): datetime of the samples
+        y (np.ndarray): data, either a single signal or several signals of
+            the same length (channels x samples), which are transformed at once
+        workers (int): number of threads for the FFT (-1: all cores)
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: frequencies and spectrum (or spectra
+            with one row per channel)
+    """
     
     # Sample size
     n = sample_size(x)
@@ -64,11 +104,12 @@ def calc_spectrum(x: np.ndarray, y: np.ndarray
     # Discrete Fourier Transform sample frequencies
     freq = sample_freq(x)
     
-    # 1D Discrete Fourier Transform
-    fft_output = scipy.fft.fft(y)
+    # 1D Discrete Fourier Transform of the real signal(s)
+    from scipy.fft import rfft
+    fft_output = rfft(y, axis=-1, workers=workers)
 
     # Remove first element (mean) and frequencies above Nyquist frequency.
-    fft_output = fft_output[1:n//2]
+    fft_output = fft_output[..., 1:n//2]
     
     # Calculate the square of the norm of each complex number
     spectrum = np.square(np.abs(fft_output))
@@ -77,10 +118,160 @@ def calc_spectrum(x: np.ndarray, y: np.ndarray
     spectrum *= freq
     
     # Multiply spectrum by 2 to account for negative frequencies
-    spectrum = [i*2 for i in spectrum]
+    spectrum *= 2
+    
+    return freq, spectrum
+
+def iter_segments(y: np.ndarray | Sequence[np.ndarray], seg_len: int, overlap: float = 0.5
+                  ) -> Iterator[np.ndarray]:
+    """Yield segments of length seg_len along the last axis of y, overlapping
+    by the fraction overlap (0 <= overlap < 1). The segments of an array are
+    views; if y is a sequence of channels (1-D arrays of equal length), only
+    the channels of each segment are stacked, not the whole series."""
+    step = max(1, int(seg_len * (1 - overlap)))
+    n = y.shape[-1] if isinstance(y, np.ndarray) else len(y[0])
+    for i in range(0, n - seg_len + 1, step):
+        if isinstance(y, np.ndarray):
+            yield y[..., i:i+seg_len]
+        else:
+            yield np.stack([channel[i:i+seg_len] for channel in y])
+
+@instrumented()
+def welch_spectrum(
+        segments: Iterable[np.ndarray],
+        sr: float,
+        seg_len: int,
+        func: Callable[..., np.ndarray] | None = None,
+        workers: int | None = None,
+        n: int | None = None
+        ) -> tuple[np.ndarray, np.ndarray]:
+    """Return the sample frequencies and the segment-averaged (Welch) spectrum.
+
+    Each segment is detrended, multiplied by the window function and
+    transformed separately, so only one segment has to be in memory. The
+    window is periodic (like in scipy.signal.welch) and normalised to a mean
+    power of 1, so it does not change the level of the spectrum, and the
+    spectrum is scaled to a record of n samples: for the same signal it has
+    the level of calc_spectrum of the whole record, so both can be compared
+    in one plot.
+
+    Args:
+        segments (Iterable[np.ndarray]): segments of length seg_len, e.g. from
+            iter_segments (several channels as rows are possible)
+        sr (float): sample rate in Hz
+        seg_len (int): number of samples per segment
+        func (Callable): window function of scipy.signal.windows
+            (default: hann)
+        workers (int): number of threads for the FFT (-1: all cores)
+        n (int): number of samples of the record (default: seg_len)
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: frequencies and mean spectrum, scaled
+            like calc_spectrum for a signal of length n
+    """
+    
+    from scipy.fft import rfft, rfftfreq
+    if func is None:
+        from scipy.signal.windows import hann as func
+
+    freq = rfftfreq(seg_len, 1/sr)[1:seg_len//2]
+    window = func(seg_len, sym=False)
+    window /= np.sqrt(np.mean(np.square(window)))
+    
+    spectrum = None
+    n_seg = 0
+    for segment in segments:
+        fft_output = rfft(detrend_signal(segment) * window, axis=-1, 
+                          workers=workers)[..., 1:seg_len//2]
+        seg_spectrum = np.square(np.abs(fft_output))
+        if spectrum is None:
+            spectrum = seg_spectrum
+        else:
+            spectrum += seg_spectrum
+        n_seg += 1
+    
+    if n_seg == 0:
+        raise ValueError(f"Signal is shorter than one segment ({seg_len} samples).")
+    
+    # Average, scale to n samples, multiply by frequency and by 2 to account
+    # for negative frequencies
+    spectrum *= 2 * freq / n_seg * (n or seg_len) / seg_len
     
     return freq, spectrum
 
+@instrumented()
+def resample_signal(x: np.ndarray, y: np.ndarray, sr: float
+                    ) -> tuple[np.ndarray, np.ndarray]:
+    """Return the datetime and the signal(s) resampled to the sample rate sr
+    with a polyphase filter (anti-aliasing included), e.g. to decimate SONIC
+    to the EXPE sample rate before the FFT.
+
+    Args:
+        x (np.ndarray): datetime of the samples
+        y (np.ndarray): data (several signals of equal length as rows possible)
+        sr (float): new sample rate in Hz
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: datetime and resampled data
+    """
+    
+    ratio = Fraction(sr / sample_rate(x)).limit_denominator(1000)
+    from scipy.signal import resample_poly
+    y_res = resample_poly(y, ratio.numerator, ratio.denominator, axis=-1)
+    
+    step = np.timedelta64(round(1e9 / sr), "ns")
+    x_res = x[0] + np.arange(y_res.shape[-1]) * step
+    return x_res, y_res
+
+def align_spectrum(freq: np.ndarray, spectrum: np.ndarray, freq_target: np.ndarray
+                   ) -> np.ndarray:
+    """Return the spectrum (or spectra as rows) linearly interpolated onto the
+    target frequencies. Target frequencies outside the range of freq (at most
+    a bin if the sample sizes differ slightly) get the value of the nearest
+    frequency."""
+    
+    if spectrum.ndim == 1:
+        return np.interp(freq_target, freq, spectrum)
+    return np.array([np.interp(freq_target, freq, spec) for spec in spectrum])
+
+@instrumented()
+def log_bin_spectrum(freq: np.ndarray, spectrum: np.ndarray, n_bins: int = 200
+                     ) -> np.ndarray:
+    """
+    Average the spectrum in n_bins log-spaced frequency bins between the
+    lowest and highest frequency. Returns a structured array with the fields
+    'from' and 'to' (bin edges), 'frequencies' (geometric bin center), 'mean',
+    'var' and 'count' (number of FFT bins). Empty bins, which occur at low
+    frequencies where a bin is narrower than the frequency resolution, are
+    left out.
+    """
+    binned = np.empty(0, dtype=[
+        ("from", float), ("to", float), ("frequencies", float),
+        ("mean", float), ("var", float), ("count", int)])
+    if len(freq) == 0:
+        return binned
+    
+    edges = np.geomspace(freq[0], freq[-1], n_bins+1)
+    idx = np.clip(np.searchsorted(edges, freq, side="right") - 1, 0, n_bins-1)
+    
+    count = np.bincount(idx, minlength=n_bins)
+    keep = count > 0
+    mean = np.bincount(idx, weights=spectrum, minlength=n_bins)[keep] / count[keep]
+    
+    # variance from the deviations of the bin mean (two passes, like _interval_mean_std)
+    dev = np.square(spectrum - np.repeat(mean, count[keep]))
+    var = np.bincount(idx, weights=dev, minlength=n_bins)[keep] / count[keep]
+    
+    binned = np.empty(np.count_nonzero(keep), dtype=binned.dtype)
+    binned["from"] = edges[:-1][keep]
+    binned["to"] = edges[1:][keep]
+    binned["frequencies"] = np.sqrt(binned["from"] * binned["to"])
+    binned["mean"] = mean
+    binned["var"] = var
+    binned["count"] = count[keep]
+    return binned
+
+@instrumented()
 def roll_mean(y: np.ndarray, win_len: int, mode: str = "nearest"
               ) -> np.ndarray:
     """
@@ -89,7 +280,49 @@ def roll_mean(y: np.ndarray, win_len: int, mode: str = "nearest"
     how the input array is extended beyond its boundaries. Default is 
     'nearest'.
     """
-    return scipy.ndimage.uniform_filter1d(y, win_len, mode=mode)
+    from scipy.ndimage import uniform_filter1d
+    return uniform_filter1d(y, win_len, mode=mode)
+
+@instrumented()
+def multi_roll_mean(y: np.ndarray, win_lens: list[int]) -> np.ndarray:
+    """
+    Calculate the rolling means of the time series y for several window
+    lengths at once from one cumulative sum, as array (window, sample).
+    Same windows and boundary extension as roll_mean (mode 'nearest'):
+    the window of sample i starts at i - win_len//2.
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    left = max(win_len // 2 for win_len in win_lens)
+    right = max(win_len - 1 - win_len // 2 for win_len in win_lens)
+
+    # the mean is removed before summing to keep the cumulative sum small
+    offset = np.mean(y)
+    padded = np.concatenate([np.full(left, y[0]), y, np.full(right, y[-1])]) - offset
+    csum = np.concatenate([[0.0], np.cumsum(padded)])
+
+    means = np.empty((len(win_lens), n))
+    for row, win_len in zip(means, win_lens):
+        start = left - win_len // 2
+        np.subtract(csum[start+win_len:start+win_len+n], csum[start:start+n], out=row)
+        row /= win_len
+    return means + offset
+
+def averaging_errors(y: np.ndarray, win_lens: list[int], ref_len: int) -> dict[str, np.ndarray]:
+    """
+    Calculate the rolling means of y for the window lengths win_lens
+    (array (window, sample)), their deviation from the rolling mean of the
+    reference window length ref_len and per window the mean, the variance
+    around zero (sum of squares / (n-1), named "Std" in the error metrics),
+    the minimum and the maximum of the deviation.
+    """
+    means = multi_roll_mean(y, [*win_lens, ref_len])
+    diff = means[:-1] - means[-1]
+    return {"means": means[:-1], "ref": means[-1], "diff": diff,
+            "Mean": diff.mean(axis=1),
+            "Std": np.einsum("ij,ij->i", diff, diff) / (diff.shape[1]-1),
+            "Lower Range": diff.min(axis=1),
+            "Upper Range": diff.max(axis=1)}
     
 
 def step_mean(y: np.ndarray, win_len: int
@@ -120,4 +353,77 @@ def turbulenzgrad(
     """Calculate the turbulence intensity of the signal."""
     wind_3d = np.sqrt(wind_x**2 + wind_y**2 + wind_z**2)
     return np.sqrt((np.std(wind_x)+np.std(wind_y)+np.std(wind_z))/3)/np.mean(wind_3d)
-    
\ No newline at end of file
+
+def interval_bounds(dt: np.ndarray, interval_min: int = 10) -> np.ndarray:
+    """
+    Return the indices of the samples at full averaging intervals (e.g.
+    hh:00, hh:10, ... for 10 minutes). Consecutive indices delimit the
+    intervals; samples before the first and after the last full interval
+    are not part of any interval.
+    """
+    ns = np.asarray(dt, dtype="datetime64[ns]").view(np.int64)
+    bounds = np.flatnonzero(ns % (interval_min*60*10**9) == 0)
+    
+    # a repeated time stamp does not open a new interval
+    return bounds[np.unique(ns[bounds], return_index=True)[1]]
+
+def _interval_mean_std(y: np.ndarray, bounds: np.ndarray
+                       ) -> tuple[np.ndarray, np.ndarray]:
+    """Return mean and standard deviation of y in each interval of bounds."""
+    y = y[bounds[0]:bounds[-1]]
+    starts = bounds[:-1] - bounds[0]
+    counts = np.diff(bounds)
+    
+    mean = np.add.reduceat(y, starts) / counts
+    var = np.add.reduceat(np.square(y - np.repeat(mean, counts)), starts) / counts
+    return mean, np.sqrt(var)
+
+@instrumented()
+def turbulente_intensitaet_bins(
+        dt: np.ndarray,
+        y: np.ndarray,
+        interval_min: int = 10
+        ) -> np.ndarray:
+    """
+    Calculate the absolute and relative turbulence intensity (see
+    turbulente_intensitaet) in all full averaging intervals at once.
+    Returns a structured array with the fields 'from', 'to', 'abs' and 'rel'.
+    """
+    bounds = interval_bounds(dt, interval_min)
+    ti = np.empty(max(len(bounds)-1, 0), dtype=[
+        ("from", "datetime64[ns]"), ("to", "datetime64[ns]"), ("abs", float), ("rel", float)])
+    if len(ti) == 0:
+        return ti
+    
+    mean, std = _interval_mean_std(y, bounds)
+    ti["from"] = dt[bounds[:-1]]
+    ti["to"] = dt[bounds[1:]]
+    ti["abs"] = std
+    ti["rel"] = std/mean
+    return ti
+
+@instrumented()
+def turbulenzgrad_bins(
+        dt: np.ndarray,
+        wind_x: np.ndarray,
+        wind_y: np.ndarray,
+        wind_z: np.ndarray,
+        interval_min: int = 10
+        ) -> np.ndarray:
+    """
+    Calculate the turbulenzgrad (see turbulenzgrad) in all full averaging 
+    intervals at once. Returns a structured array with the fields 'from', 
+    'to' and 'turbulenzgrad'.
+    """
+    bounds = interval_bounds(dt, interval_min)
+    tg = np.empty(max(len(bounds)-1, 0), dtype=[
+        ("from", "datetime64[ns]"), ("to", "datetime64[ns]"), ("turbulenzgrad", float)])
+    if len(tg) == 0:
+        return tg
+    
+    std_sum = sum(_interval_mean_std(w, bounds)[1] for w in (wind_x, wind_y, wind_z))
+    mean_3d = _interval_mean_std(np.sqrt(wind_x**2 + wind_y**2 + wind_z**2), bounds)[0]
+    tg["from"] = dt[bounds[:-1]]
+    tg["to"] = dt[bounds[1:]]
+    tg["turbulenzgrad"] = np.sqrt(std_sum/3)/mean_3d
+    return tg
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import os
+from typing import TYPE_CHECKING
+import numpy as np
+
+from setup import RESULTS_DIR, RESULTS_FORMAT, RESULTS_COMPRESS
+from files import atomic_write
+from instrument import instrumented
+
+# pandas is only imported for csv-files and to read results (plots)
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def results_fn(kind: str, name: str, fmt: str = RESULTS_FORMAT) -> str:
+    """Return the file of a result, e.g. kind='spectra_data' and
+    name='PUO_01_EXPE_spectrum_data'."""
+    if fmt not in ("npz", "csv"):
+        raise ValueError(f"Invalid results format '{fmt}'.")
+    return os.path.join(RESULTS_DIR, kind, f"{name}.{fmt}")
+
+def find_results(kind: str, name: str) -> str:
+    """Return the file of a saved result: of the csv- and npz-file the one
+    written last, so a result is read in the other format only if it was
+    not saved again after RESULTS_FORMAT was changed (e.g. the committed csv
+    results of PUOs without raw files). If there is none, the file in the
+    format of RESULTS_FORMAT."""
+    fns = [fn for fn in (results_fn(kind, name, "csv"), results_fn(kind, name, "npz"))
+           if os.path.exists(fn)]
+    return max(fns, key=os.path.getmtime) if fns else results_fn(kind, name)
+
+@instrumented()
+def write_results(
+        kind: str,
+        name: str,
+        data: dict[str, np.ndarray] | pd.DataFrame,
+        fmt: str = RESULTS_FORMAT
+        ) -> None:
+    """
+    Save a result (columns of equal length) in the format of RESULTS_FORMAT:
+    'npz' stores each column as binary array (no float formatting, single
+    columns can be read without loading the others), 'csv' as text.
+    """
+    fn = results_fn(kind, name, fmt)
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+
+    if fmt == "csv":
+        import pandas as pd
+        atomic_write(fn, lambda f: pd.DataFrame(data).to_csv(f, index=False))
+        return
+
+    # text columns (object arrays) are stored as unicode arrays, not pickled
+    columns = {col: np.asarray(data[col]) for col in data}
+    columns = {col: arr.astype(str) if arr.dtype == object else arr for col, arr in columns.items()}
+    savez = np.savez_compressed if RESULTS_COMPRESS else np.savez
+    atomic_write(fn, lambda f: savez(f, **columns))
+
+@instrumented()
+def read_results(
+        kind: str,
+        name: str,
+        columns: list[str] | None = None,
+        fmt: str | None = None
+        ) -> pd.DataFrame:
+    """Return a result saved with write_results, only the given columns if
+    columns is not None. Without fmt the file is looked up with
+    find_results."""
+    import pandas as pd
+    fn = find_results(kind, name) if fmt is None else results_fn(kind, name, fmt)
+
+    if fn.endswith(".csv"):
+        return pd.read_csv(fn, usecols=columns)[columns] if columns else pd.read_csv(fn)
+
+    with np.load(fn) as f:
+        return pd.DataFrame({col: f[col] for col in (columns or f.files)})
+
+@instrumented()
+def read_results_many(
+        kind: str,
+        names: list[str],
+        columns: list[str] | None = None,
+        fmt: str | None = None
+        ) -> pd.DataFrame:
+    """Return several results saved with write_results as one table with
+    the name of the result in the column 'name'. The columns of npz-files
+    are concatenated before the table is built."""
+    import pandas as pd
+
+    fns = {name: find_results(kind, name) if fmt is None else results_fn(kind, name, fmt)
+           for name in names}
+    if any(fn.endswith(".csv") for fn in fns.values()):
+        return pd.concat([read_results(kind, name, columns, fns[name][-3:]).assign(name=name)
+                          for name in names], ignore_index=True)
+
+    data = {}
+    for name, fn in fns.items():
+        with np.load(fn) as f:
+            cols = columns or f.files
+            for col in cols:
+                data.setdefault(col, []).append(f[col])
+            data.setdefault("name", []).append(np.full(len(f[cols[0]]), name))
+    return pd.DataFrame({col: np.concatenate(arrays) for col, arrays in data.items()})
@@ -11,8 +11,52 @@ KERNEL_SIZE = 10
 WINDOWS_MIN = [1, 5, 10, 30, 60]
 SAMPLE_RATE = {"EXPE": 1, "SONIC": 2}
 MITTELUNGSINTERVALL = 60
+TI_INTERVAL_MIN = 10        # averaging interval of the turbulence intensity in minutes
+FFT_WORKERS = 1             # threads per FFT (-1: all cores)
 
-unique_dates = ["08.07.2023", "11.07.2023", "11.08.2023", "12.08.2023", "14.08.2023"]
+# spectrum estimator per device: "periodogram" (whole period) or "welch"
+# (mean of overlapping, windowed segments)
+SPECTRUM_METHOD = {"EXPE": "periodogram", "SONIC": "periodogram"}
+WELCH_SEGMENT_MIN = 30      # segment length in minutes
+WELCH_OVERLAP = 0.5         # overlap of neighbouring segments
+WELCH_WINDOW = "hann"       # name of a function in window_functions
+SPECTRUM_BINS = 200         # log-spaced frequency bins of the binned spectra (used by the plots)
+SAVE_FULL_SPECTRA = True    # also save the spectra with all FFT bins (large files)
+
+RAW_DATA_DIR = "data/raw_data"      # raw files in subdirectories YYYY_MM_DD
+PERIODS_FN = "data/periods.csv"     # periods under observation
+
+CACHE_DIR = "data/cache"    # parsed raw files are cached here
+PARSE_CACHE = True          # reuse parsed raw files between runs
+RAW_FILES_IN_MEMORY = 8     # number of parsed raw files kept in memory
+SEEK_MIN_FILE_SIZE = 100 * 1024**2  # raw files of this size (bytes) are read by time range
+STAGE_CACHE = True          # reuse results of the main_calculation stages if their inputs are unchanged
+STAGE_CACHE_DIR = "data/cache/stages"
+
+RESULTS_DIR = "data"         # results are saved in subdirectories (timeseries_data, spectra_data, ...)
+RESULTS_FORMAT = "csv"      # "csv" (text, the results in the repository) or "npz" (binary,
+                            # faster to write and read, not committed)
+RESULTS_COMPRESS = True     # zip-compress the npz files
+
+BENCHMARK_DIR = "data/benchmarks"   # JSON results of benchmark.py
+INSTRUMENT_DIR = "data/instrument"  # timing and memory reports of cli.py --instrument
+
+TIMESERIES_STORE = False    # additionally store preprocessed time series as binary arrays
+TIMESERIES_STORE_DIR = "data/timeseries_store"
+
+# render profiles of the plots (cli.py plot --profile ...): resolution (also of the
+# decimation of time series), file format, antialiasing and directory (instead of plots/)
+RENDER_PROFILE = "final"
+RENDER_PROFILES = {
+    "draft": {"dpi": 100, "format": "png", "antialiased": False, "dir": "plots/draft"},
+    "final": {"dpi": 600, "format": "png", "antialiased": True, "dir": "plots"},
+    "vector": {"dpi": 600, "format": "pdf", "antialiased": True, "dir": "plots/vector"},
+    }
+PLOT_DECIMATION = "minmax"  # dense time series are reduced to the pixel columns of the figure:
+                            # "minmax" (envelope per column, keeps all peaks), "lttb" or None (all samples)
+
+# plot types of main_plotting.py (cli.py plot --plot ...), in the order they are plotted
+PLOT_TYPES = ["coverage", "timeseries", "spectra", "window", "averaging", "turbulence"]
 
 all_puos = ["PUO_01", "PUO_02", "PUO_03", "PUO_04", "PUO_05", "PUO_06", 
             "PUO_07", "PUO_08", "PUO_09", "PUO_10", "PUO_11"]
@@ -20,160 +64,30 @@ all_puos = ["PUO_01", "PUO_02", "PUO_03", "PUO_04", "PUO_05", "PUO_06",
 
 def metadata(period: str) -> tuple:
     """
-    Return metadata for a given period. The period can be a whole day or a
-    period under observation (PUO).
+    Return metadata (EXPE file, SONIC file, start datetime, end datetime,
+    date, day) for a given period. The period can be a whole day or a
+    period under observation (PUO), see periods.py.
     """
+    from periods import get_period
+    return get_period(period).metadata()
 
-    match period:
-        
-        # -------------------------------------------------------------------------
-        # whole days
-        # -------------------------------------------------------------------------
-        
-        case "Day1":
-            expe_fn =           "data/raw_data/2023_07_08/20230708-1329-Log.txt"
-            sonic_fn =          "data/raw_data/2023_07_08/TOA5_7134.Raw_2023_07_08_0923.dat"
-            start_datetime =    "2023-07-08 00:00:00"
-            end_datetime =      "2023-07-08 23:59:00"
-            date =              "08.07.2023"
-            day =               1
-        case "Day2":
-            expe_fn =           "data/raw_data/2023_07_11/20230711-0504-Log.txt"
-            sonic_fn =          "data/raw_data/2023_07_11/TOA5_7134.Raw_2023_07_11_0601.dat"
-            start_datetime =    "2023-07-11 00:00:00"
-            end_datetime =      "2023-07-11 23:59:00"
-            date =              "11.07.2023"
-            day =               2
-        case "Day3":
-            expe_fn =           "data/raw_data/2023_08_11/20230811-0810-Log.txt"
-            sonic_fn =          "data/raw_data/2023_08_11/TOA5_7134.Raw_2023_08_11_0924.dat"
-            start_datetime =    "2023-08-11 00:00:00"
-            end_datetime =      "2023-08-11 23:59:00"
-            date =              "11.08.2023"
-            day =               3
-        case "Day4":
-            expe_fn =           "data/raw_data/2023_08_12/20230812-0641-Log.txt"
-            sonic_fn =          "data/raw_data/2023_08_12/TOA5_7134.Raw_2023_08_12_0755.dat"
-            start_datetime =    "2023-08-12 00:00:00"
-            end_datetime =      "2023-08-12 23:59:00"
-            date =              "12.08.2023"
-            day =               4
-        case "Day5":
-            expe_fn =           "data/raw_data/2023_08_14/20230814-0656-Log.txt"
-            sonic_fn =          "data/raw_data/2023_08_14/TOA5_7134.Raw_2023_08_14_0749.dat"
-            start_datetime =    "2023-08-14 00:00:00"
-            end_datetime =      "2023-08-14 23:59:00"
-            date =              "14.08.2023"
-            day =               5
-        
-        # -------------------------------------------------------------------------
-        # periods under observation
-        # -------------------------------------------------------------------------
-        
-        case "PUO_00_0": # no expe data
-            expe_fn =           "data/raw_data/2023_07_08/20230708-1329-Log.txt"
-            sonic_fn =          "data/raw_data/2023_07_08/TOA5_7134.Raw_2023_07_08_0923.dat"
-            start_datetime =    "2023-07-08 08:25:00" # min: 2023-07-08 08:25:00
-            end_datetime =      "2023-07-08 10:10:00" # max: 2023-07-08 10:10:00
-            date =              "08.07.2023"
-            day =               1
-        case "PUO_00_1": # no expe data
-            expe_fn =           "data/raw_data/2023_07_08/20230708-1329-Log.txt"
-            sonic_fn =          "data/raw_data/2023_07_08/TOA5_7134.Raw_2023_07_08_0923.dat"
-            start_datetime =    "2023-07-08 11:30:00" # min: 2023-07-08 11:30:00
-            end_datetime =      "2023-07-08 12:45:00" # max: 2023-07-08 12:45:00
-            date =              "08.07.2023"
-            day =               1
-        case "PUO_01":
-            expe_fn =           "data/raw_data/2023_07_08/20230708-1329-Log.txt"
-            sonic_fn =          "data/raw_data/2023_07_08/TOA5_7134.Raw_2023_07_08_0923.dat"
-            start_datetime =    "2023-07-08 13:30:00" # min: 2023-07-08 13:30:00
-            end_datetime =      "2023-07-08 15:00:00" # max: 2023-07-08 16:10:00
-            date =              "08.07.2023"
-            day =               1
-        case "PUO_02":
-            expe_fn =           "data/raw_data/2023_07_11/20230711-0504-Log.txt"
-            sonic_fn =          "data/raw_data/2023_07_11/TOA5_7134.Raw_2023_07_11_0601.dat"
-            start_datetime =    "2023-07-11 06:15:00" # min: 2023-07-11 05:05:00
-            end_datetime =      "2023-07-11 07:00:00" # max: 2023-07-11 07:00:00
-            date =              "11.07.2023"
-            day =               2
-        case "PUO_03": # GAS
-            expe_fn =           "data/raw_data/2023_07_11/20230711-0504-Log.txt"
-            sonic_fn =          "data/raw_data/2023_07_11/TOA5_7134.Raw_2023_07_11_0601.dat"
-            start_datetime =    "2023-07-11 10:00:00" # min: 2023-07-11 10:00:00
-            end_datetime =      "2023-07-11 11:00:00" # max: 2023-07-11 11:00:00
-            date =              "11.07.2023"
-            day =               2
-        case "PUO_04":
-            expe_fn =           "data/raw_data/2023_07_11/20230711-0504-Log.txt"
-            sonic_fn =          "data/raw_data/2023_07_11/TOA5_7134.Raw_2023_07_11_0601.dat"
-            start_datetime =    "2023-07-11 11:36:00" # min: 2023-07-11 11:36:00
-            end_datetime =      "2023-07-11 12:36:00" # max: 2023-07-11 12:36:00
-            date =              "11.07.2023"
-            day =               2
-        case "PUO_05":
-            expe_fn =           "data/raw_data/2023_08_11/20230811-0810-Log.txt"
-            sonic_fn =          "data/raw_data/2023_08_11/TOA5_7134.Raw_2023_08_11_0924.dat"
-            start_datetime =    "2023-08-11 08:25:00" # min: 2023-08-11 08:25:00
-            end_datetime =      "2023-08-11 09:55:00" # max: 2023-08-11 09:55:00
-            date =              "11.08.2023"
-            day =               3
-        case "PUO_06":
-            expe_fn =           "data/raw_data/2023_08_11/20230811-0810-Log.txt"
-            sonic_fn =          "data/raw_data/2023_08_11/TOA5_7134.Raw_2023_08_11_0924.dat"
-            start_datetime =    "2023-08-11 12:20:00" # min: 2023-08-11 12:20:00
-            end_datetime =      "2023-08-11 14:00:00" # max: 2023-08-11 16:50:00
-            date =              "11.08.2023"
-            day =               3
-        case "PUO_07":
-            expe_fn =           "data/raw_data/2023_08_11/20230811-0810-Log.txt"
-            sonic_fn =          "data/raw_data/2023_08_11/TOA5_7134.Raw_2023_08_11_0924.dat"
-            start_datetime =    "2023-08-11 15:45:00" # min: 2023-08-11 12:20:00
-            end_datetime =      "2023-08-11 16:45:00" # max: 2023-08-11 16:50:00
-            date =              "11.08.2023"
-            day =               3
-        case "PUO_08":
-            expe_fn =           "data/raw_data/2023_08_12/20230812-0641-Log.txt"
-            sonic_fn =          "data/raw_data/2023_08_12/TOA5_7134.Raw_2023_08_12_0755.dat"
-            start_datetime =    "2023-08-12 08:00:00" # min: 2023-08-12 06:55:00
-            end_datetime =      "2023-08-12 09:45:00" # max: 2023-08-12 14:20:00
-            date =              "12.08.2023"
-            day =               4
-        case "PUO_09":
-            expe_fn =           "data/raw_data/2023_08_12/20230812-0641-Log.txt"
-            sonic_fn =          "data/raw_data/2023_08_12/TOA5_7134.Raw_2023_08_12_0755.dat"
-            start_datetime =    "2023-08-12 12:00:00" # min: 2023-08-12 06:55:00
-            end_datetime =      "2023-08-12 13:00:00" # max: 2023-08-12 14:20:00
-            date =              "12.08.2023"
-            day =               4
-        case "PUO_10":
-            expe_fn =           "data/raw_data/2023_08_14/20230814-0656-Log.txt"
-            sonic_fn =          "data/raw_data/2023_08_14/TOA5_7134.Raw_2023_08_14_0749.dat"
-            start_datetime =    "2023-08-14 08:00:00" # min: 2023-08-14 07:00:00
-            end_datetime =      "2023-08-14 09:30:00" # max: 2023-08-14 16:55:00
-            date =              "14.08.2023"
-            day =               5
-        case "PUO_11":
-            expe_fn =           "data/raw_data/2023_08_14/20230814-0656-Log.txt"
-            sonic_fn =          "data/raw_data/2023_08_14/TOA5_7134.Raw_2023_08_14_0749.dat"
-            start_datetime =    "2023-08-14 12:45:00" # min: 2023-08-14 07:00:00
-            end_datetime =      "2023-08-14 14:20:00" # max: 2023-08-14 16:55:00
-            date =              "14.08.2023"
-            day =               5
-        
-    return expe_fn, sonic_fn, start_datetime, end_datetime, date, day
-
-
-import scipy.signal.windows as wf
-
-window_functions = [
+
+# nonparametric window functions of scipy.signal.windows, setup.window_functions
+# is only created on first use, because importing scipy.signal is slow
+_WINDOW_FUNCTIONS = [
     # No parameters:
-    wf.boxcar, wf.exponential, wf.blackman, wf.blackmanharris, 
-    wf.bohman, wf.barthann, wf.cosine, wf.flattop, wf.hamming, wf.hann, 
-    wf.lanczos, wf.nuttall, wf.parzen, wf.taylor, wf.triang, wf.tukey,
+    "boxcar", "exponential", "blackman", "blackmanharris", 
+    "bohman", "barthann", "cosine", "flattop", "hamming", "hann", 
+    "lanczos", "nuttall", "parzen", "taylor", "triang", "tukey",
     
     # Need parameters:
-    # wf.chebwin, wf.dpss, wf.gaussian, wf.general_cosine, wf.general_gaussian,
-    # wf.general_hamming, wf.kaiser, wf.kaiser_bessel_derived, 
+    # "chebwin", "dpss", "gaussian", "general_cosine", "general_gaussian",
+    # "general_hamming", "kaiser", "kaiser_bessel_derived", 
     ]
+
+def __getattr__(name: str):
+    if name == "window_functions":
+        import scipy.signal.windows as wf
+        globals()["window_functions"] = [getattr(wf, func) for func in _WINDOW_FUNCTIONS]
+        return globals()["window_functions"]
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
@@ -0,0 +1,88 @@
+import os
+import hashlib
+from types import ModuleType
+from typing import Callable
+import numpy as np
+
+from setup import STAGE_CACHE, STAGE_CACHE_DIR
+from files import atomic_write
+from instrument import instrumented
+
+
+def stage_key(*parts) -> str:
+    """Return a hash of the (printable) inputs of a stage."""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+def code_fingerprint(*fns: str) -> str:
+    """Return a hash of the content of source files, so that cached results
+    are invalidated when the code computing them changes."""
+    sha = hashlib.sha1()
+    for fn in fns:
+        with open(fn, "rb") as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def settings_fingerprint(module: ModuleType, exclude: set[str] = frozenset()) -> str:
+    """Return a hash of the settings of a module (public names which are not
+    functions or modules, e.g. of setup), except the names in exclude."""
+    settings = {name: value for name, value in vars(module).items()
+                if not name.startswith("_") and name not in exclude
+                and not callable(value) and not isinstance(value, ModuleType)}
+    return stage_key(*sorted(settings.items()))
+
+
+class Stage:
+    """
+    A step of a pipeline whose result (a dict of arrays) is memoized on disk.
+
+    The key of a stage is a hash of its name, its own inputs (e.g. file
+    fingerprints and parameters) and the keys of the upstream stages. So
+    changing a parameter invalidates the stage and all stages downstream,
+    while the upstream results are reused. Upstream stages are only
+    computed (or loaded) if this stage is not cached.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            inputs: list,
+            compute: Callable[..., dict[str, np.ndarray]],
+            *upstream: "Stage",
+            cache: bool = True
+            ) -> None:
+        self.name = name
+        self.compute = compute
+        self.upstream = upstream
+        self.cache = cache and STAGE_CACHE
+        self.key = stage_key(name, *inputs, *(stage.key for stage in upstream))
+        self._result = None
+
+    @property
+    def cache_fn(self) -> str:
+        return os.path.join(STAGE_CACHE_DIR, f"{self.name}.npz")
+
+    def result(self) -> dict[str, np.ndarray]:
+        """Return the result from memory, from disk or compute it."""
+        if self._result is None:
+            self._result = self._read() if self.cache else None
+        if self._result is None:
+            self._result = self.compute(*(stage.result() for stage in self.upstream))
+            if self.cache:
+                self._write(self._result)
+        return self._result
+
+    @instrumented("stage_cache.read")
+    def _read(self) -> dict[str, np.ndarray] | None:
+        if not os.path.exists(self.cache_fn):
+            return None
+        with np.load(self.cache_fn) as cache:
+            if str(cache["__key__"]) != self.key:
+                return None
+            return {k: cache[k] for k in cache.files if k != "__key__"}
+
+    @instrumented("stage_cache.write")
+    def _write(self, result: dict[str, np.ndarray]) -> None:
+        # one file per stage name, so outdated results are overwritten
+        os.makedirs(STAGE_CACHE_DIR, exist_ok=True)
+        atomic_write(self.cache_fn, lambda f: np.savez(f, __key__=self.key, **result))
@@ -0,0 +1,74 @@
+import os
+import json
+import numpy as np
+
+from setup import TIMESERIES_STORE_DIR
+
+
+def _series_dir(period: str, device: str) -> str:
+    """Return the directory holding the time series of a period and device."""
+    return os.path.join(TIMESERIES_STORE_DIR, f"{period}_{device}")
+
+def write_series(
+        period: str,
+        device: str,
+        dt: np.ndarray,
+        series: dict[str, np.ndarray],
+        sample_rate: float
+        ) -> None:
+    """
+    Store time series of a period and device as contiguous binary arrays
+    (little-endian float64, datetime as int64 ns) with a JSON header holding
+    the start time, sample rate, sample size and variables.
+    """
+    series_dir = _series_dir(period, device)
+    os.makedirs(series_dir, exist_ok=True)
+
+    np.ascontiguousarray(dt, dtype="datetime64[ns]").view("<i8").tofile(
+        os.path.join(series_dir, "datetime.i8"))
+    for var, y in series.items():
+        np.ascontiguousarray(y, dtype="<f8").tofile(os.path.join(series_dir, f"{var}.f8"))
+
+    header = {
+        "start": str(np.datetime64(dt[0], "ns")) if len(dt) else None,
+        "sample_rate": sample_rate,
+        "n": len(dt),
+        "variables": list(series.keys())
+        }
+    with open(os.path.join(series_dir, "header.json"), "w") as f:
+        json.dump(header, f, indent=4)
+
+def has_series(period: str, device: str) -> bool:
+    """Return True if time series of a period and device are stored."""
+    return os.path.exists(os.path.join(_series_dir(period, device), "header.json"))
+
+def read_header(period: str, device: str) -> dict:
+    """Return the header of the stored time series of a period and device."""
+    with open(os.path.join(_series_dir(period, device), "header.json")) as f:
+        return json.load(f)
+
+def open_series(period: str, device: str, var: str) -> np.memmap:
+    """Return a stored time series as read-only memory map. Use var='datetime'
+    for the time stamps."""
+    series_dir = _series_dir(period, device)
+    n = read_header(period, device)["n"]
+
+    if var == "datetime":
+        return np.memmap(os.path.join(series_dir, "datetime.i8"), dtype="<i8",
+                         mode="r", shape=(n,)).view("datetime64[ns]")
+    return np.memmap(os.path.join(series_dir, f"{var}.f8"), dtype="<f8",
+                     mode="r", shape=(n,))
+
+def read_window(
+        period: str,
+        device: str,
+        var: str,
+        start_datetime: str,
+        end_datetime: str
+        ) -> tuple[np.ndarray, np.ndarray]:
+    """Return the time stamps and values of a stored time series between start
+    and end datetime (inclusive) as views into the memory maps."""
+    dt = open_series(period, device, "datetime")
+    i_start = np.searchsorted(dt, np.datetime64(start_datetime), side="left")
+    i_end = np.searchsorted(dt, np.datetime64(end_datetime), side="right")
+    return dt[i_start:i_end], open_series(period, device, var)[i_start:i_end]